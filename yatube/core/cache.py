@@ -0,0 +1,356 @@
+"""Общий для всех процессов кеш и помощники для работы с ним."""
+import math
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+LOCK_TIMEOUT = 10
+STALE_GRACE = 60
+MISSING = object()
+
+
+class CacheStats:
+    """Попадания и промахи кеша в процессе; считаются под блокировкой."""
+
+    def __init__(self, name='cache_tracked'):
+        self._lock = threading.Lock()
+        self._tracked = ContextVar(name, default=None)
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+        tracked = self._tracked.get()
+        if tracked is not None:
+            tracked['hits'] += hits
+            tracked['misses'] += misses
+
+    def ratio(self):
+        """Доля попаданий."""
+        with self._lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    @contextmanager
+    def track(self):
+        """Попадания и промахи одного запроса, без соседних потоков."""
+        counts = {'hits': 0, 'misses': 0}
+        token = self._tracked.set(counts)
+        try:
+            yield counts
+        finally:
+            self._tracked.reset(token)
+
+
+cache_stats = CacheStats()
+
+
+class CountingCache(BaseCache):
+    """Обёртка кеша ``LOCATION`` (другой псевдоним ``CACHES``).
+
+    Считает попадания и промахи ``get`` и ``get_many`` в ``cache_stats``
+    для любого бэкенда, остальное передаёт как есть.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._alias = location
+
+    @property
+    def _cache(self):
+        return caches[self._alias]
+
+    def get(self, key, default=None, version=None):
+        value = self._cache.get(key, MISSING, version=version)
+        if value is MISSING:
+            cache_stats.count(0, 1)
+            return default
+        cache_stats.count(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self._cache.get_many(keys, version=version)
+        cache_stats.count(len(found), len(keys) - len(found))
+        return found
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.add(key, value, timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set_many(data, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.touch(key, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._cache.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        return self._cache.decr(key, delta, version)
+
+    def has_key(self, key, version=None):
+        return self._cache.has_key(key, version)
+
+    def delete(self, key, version=None):
+        return self._cache.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        return self._cache.delete_many(keys, version)
+
+    def clear(self):
+        return self._cache.clear()
+
+
+class SQLiteCache(BaseCache):
+    """Кеш в файле SQLite, общий для всех воркеров одной машины.
+
+    Работает без внешних сервисов. Файл открывается в режиме WAL, так что
+    чтения не ждут записей. Целые числа хранятся как есть, поэтому ``incr``
+    выполняется атомарно, в самой базе. Остальные значения сериализуются
+    через pickle.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+    cull_every = 100
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._connection = None
+        self._writes = 0
+
+    @property
+    def _db(self):
+        if self._connection is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self._path, timeout=LOCK_TIMEOUT, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                ' key TEXT PRIMARY KEY, value BLOB, expires REAL)'
+            )
+            # чистка устаревших записей в _cull идёт по индексу
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)'
+            )
+            self._connection = connection
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _dump(self, value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, self.pickle_protocol)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _write(self, sql, params):
+        self._writes += 1
+        if self._writes % self.cull_every == 0:
+            self._cull()
+        return self._db.execute(sql, params).rowcount
+
+    def _cull(self):
+        db = self._db
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            db.execute('DELETE FROM cache')
+            return
+        db.execute(
+            'DELETE FROM cache WHERE rowid IN ('
+            ' SELECT rowid FROM cache ORDER BY rowid LIMIT ?)',
+            (count // self._cull_frequency,)
+        )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        return bool(self._write(
+            'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            ' value = excluded.value, expires = excluded.expires '
+            'WHERE cache.expires <= ?',
+            (key, self._dump(value), self.get_backend_timeout(timeout), now)
+        ))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self._db.execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return default
+        return self._load(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        placeholders = ', '.join('?' * len(keys))
+        rows = self._db.execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            (*keys, time.time())
+        )
+        return {keys[key]: self._load(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._write(
+            'REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, self._dump(value), self.get_backend_timeout(timeout))
+        )
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (self._key(key, version), self._dump(value), expires)
+            for key, value in data.items()
+        ]
+        with self._transaction() as db:
+            db.executemany(
+                'REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                rows
+            )
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return bool(self._write(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time())
+        ))
+
+    def incr(self, key, delta=1, version=None):
+        cache_key = self._key(key, version)
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE cache SET value = value + ? WHERE key = ? "
+                "AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, cache_key, time.time())
+            ).rowcount
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ?', (cache_key,)
+            ).fetchone()
+        if not updated:
+            # нет ключа или в нём не целое число — сделает общий путь
+            return super().incr(key, delta, version)
+        return row[0]
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def delete(self, key, version=None):
+        self._write('DELETE FROM cache WHERE key = ?',
+                    (self._key(key, version),))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            placeholders = ', '.join('?' * len(keys))
+            self._write(
+                f'DELETE FROM cache WHERE key IN ({placeholders})', keys
+            )
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+
+def namespace_prefix(namespace):
+    """Префикс ключей пространства имён, которое можно сбросить целиком.
+
+    В префикс входит текущая версия пространства, так что ключи,
+    записанные до ``invalidate_namespace``, больше не читаются.
+    """
+    version_key = f'namespace:{namespace}'
+    version = cache.get(version_key)
+    if version is None:
+        version = time.time()
+        cache.add(version_key, version, None)
+        version = cache.get(version_key, version)
+    return f'{namespace}:{version}'
+
+
+def invalidate_namespace(namespace):
+    """Сбрасывает все ключи пространства имён сменой его версии."""
+    cache.set(f'namespace:{namespace}', time.time(), None)
+
+
+def get_or_recompute(key, compute, timeout, is_fresh=None, beta=1.0):
+    """Значение из кеша с защитой от «набега» на пересчёт.
+
+    Значение пересчитывается заранее, с вероятностью, которая растёт
+    по мере приближения срока (алгоритм XFetch), и только одним процессом:
+    остальные, пока держится замок, получают прежнее значение.
+    ``is_fresh`` позволяет признать значение устаревшим досрочно.
+    ``compute`` может вернуть None — тогда ничего не кешируется.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expiry = entry
+        fresh = is_fresh is None or is_fresh(value)
+        early = delta * beta * math.log(random.random() or 1e-12)
+        if fresh and time.time() - early < expiry:
+            return value
+    lock = f'{key}:lock'
+    locked = cache.add(lock, True, LOCK_TIMEOUT)
+    if not locked and entry is not None:
+        return value
+    try:
+        started = time.time()
+        value = compute()
+        delta = time.time() - started
+        if value is not None:
+            cache.set(
+                key, (value, delta, time.time() + timeout),
+                timeout + STALE_GRACE
+            )
+    finally:
+        if locked:
+            cache.delete(lock)
+    return value
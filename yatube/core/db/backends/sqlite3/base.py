@@ -0,0 +1,69 @@
+"""SQLite, настроенный для работы под нагрузкой.
+
+Отличия от стандартного бэкенда:
+
+* при открытии соединения выполняются ``PRAGMAS``: журнал WAL (чтения
+  не ждут записей), ``synchronous=NORMAL``, отображение файла в память
+  и увеличенный кеш страниц; их можно дополнить или переопределить
+  в ``OPTIONS['pragmas']``;
+* транзакции начинаются с ``BEGIN IMMEDIATE``
+  (``OPTIONS['transaction_mode']``): пишущая транзакция сразу берёт
+  блокировку и ждёт её ``timeout`` секунд, а не падает с «database is
+  locked» на первой записи;
+* запрос, получивший «database is locked», повторяется ``RETRIES`` раз
+  с растущей паузой.
+
+Долгоживущие соединения включаются обычным ``CONN_MAX_AGE``.
+"""
+import time
+
+from django.db.backends.sqlite3 import base
+
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # в КиБ: 64 МиБ
+    'temp_store': 'MEMORY',
+}
+RETRIES = 5
+RETRY_DELAY = 0.05
+
+
+def retry_locked(method, *args):
+    for attempt in range(RETRIES + 1):
+        try:
+            return method(*args)
+        except base.Database.OperationalError as error:
+            if 'locked' not in str(error) or attempt == RETRIES:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    def execute(self, query, params=None):
+        return retry_locked(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return retry_locked(super().executemany, query, param_list)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **params.pop('pragmas', {})}
+        self.transaction_mode = params.pop('transaction_mode', 'IMMEDIATE')
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def create_cursor(self, name=None):
+        return self.connection.cursor(factory=SQLiteCursorWrapper)
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}'.strip())
@@ -0,0 +1,116 @@
+"""Чтение с реплик для представлений, которые только читают.
+
+Представление помечается ``reads_from_replica``; на время GET- и
+HEAD-запросов к нему ``ReplicaMiddleware`` разрешает ``ReplicaRouter``
+отправлять чтения на одну из баз ``DATABASE_REPLICAS``. Все записи и
+чтения прочих представлений идут в ``default``.
+
+Реплика отстаёт, поэтому после каждой записи (POST и других небезопасных
+запросов) клиент получает куку и ``REPLICA_STICKY_SECONDS`` секунд читает
+только с основной базы — свои изменения он видит сразу.
+
+Остальные читатели видят реплику с отставанием, а кеши с версиями
+(страницы, карточки, счётчики) считают свежим всё, что записано после
+изменения. Поэтому то, что пойдёт в такой кеш, читается внутри
+``primary_reads()``, а прочитанное с реплики не кешируется
+(``reading_from_replica``, ``used_replica``).
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+STICKY_COOKIE = 'primary_reads'
+SAFE_METHODS = ('GET', 'HEAD')
+
+_reads = ContextVar('replica_reads', default=None)
+
+
+class ReplicaReads:
+    """Чтения запроса: можно ли сейчас отдать их реплике и отданы ли."""
+
+    def __init__(self):
+        self.allowed = True
+        self.used = False
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def reading_from_replica():
+    """Пойдёт ли следующее чтение на реплику."""
+    reads = _reads.get()
+    return reads is not None and reads.allowed and bool(replicas())
+
+
+def used_replica():
+    """Было ли в этом запросе хоть одно чтение с реплики."""
+    reads = _reads.get()
+    return reads is not None and reads.used
+
+
+@contextmanager
+def primary_reads():
+    """Внутри блока все чтения идут в основную базу."""
+    reads = _reads.get()
+    if reads is None:
+        yield
+        return
+    allowed, reads.allowed = reads.allowed, False
+    try:
+        yield
+    finally:
+        reads.allowed = allowed
+
+
+def reads_from_replica(view):
+    """Помечает представление: его чтения можно отдать реплике."""
+    view.reads_from_replica = True
+    return view
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if reading_from_replica():
+            _reads.get().used = True
+            return random.choice(replicas())
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # реплики получают схему вместе с данными от основной базы
+        return db not in replicas()
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, '_replica_token', None)
+            if token is not None:
+                _reads.reset(token)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, '1', httponly=True, samesite='Lax',
+                max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10),
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in SAFE_METHODS
+                and getattr(view_func, 'reads_from_replica', False)
+                and STICKY_COOKIE not in request.COOKIES):
+            request._replica_token = _reads.set(ReplicaReads())
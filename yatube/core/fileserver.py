@@ -0,0 +1,205 @@
+"""Раздача статики и медиа прямо из WSGI, минуя Django.
+
+``FileServer`` оборачивает WSGI-приложение и сам отвечает на GET и HEAD
+под ``STATIC_URL`` и ``MEDIA_URL``: с ETag и Last-Modified (условные
+запросы получают 304), с заранее сжатыми копиями ``.br``/``.gz`` для
+клиентов, которые их принимают, и с поддержкой одного диапазона
+``Range``. Целые файлы уходят через ``wsgi.file_wrapper``, так что
+сервер вроде gunicorn отправляет их через sendfile, без копирования.
+
+Имена с хешем содержимого (статика после ``collectstatic`` и картинки
+постов) неизменны и кешируются на год, остальные — ненадолго.
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+
+
+BLOCK_SIZE = 64 * 1024
+IMMUTABLE_RE = re.compile(r'(\.[0-9a-f]{12}|/[0-9a-f]{64})\.\w+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MUTABLE = 'public, max-age=60'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileServer:
+    def __init__(self, application, roots=None):
+        self.application = application
+        if roots is None:
+            roots = [
+                (settings.STATIC_URL, settings.STATIC_ROOT),
+                (settings.MEDIA_URL, settings.MEDIA_ROOT),
+            ]
+        self.roots = [(prefix, root) for prefix, root in roots if root]
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            path = self.find(unquote(environ.get('PATH_INFO', '')))
+            if path is not None:
+                return self.serve(path, environ, start_response)
+        return self.application(environ, start_response)
+
+    def find(self, url):
+        for prefix, root in self.roots:
+            if url.startswith(prefix):
+                try:
+                    path = safe_join(root, url[len(prefix):])
+                except SuspiciousFileOperation:
+                    return None
+                return path if os.path.isfile(path) else None
+        return None
+
+    def serve(self, path, environ, start_response):
+        content_type = mimetypes.guess_type(path)[0]
+        headers = [
+            ('Content-Type', content_type or 'application/octet-stream'),
+            ('Cache-Control',
+             IMMUTABLE if IMMUTABLE_RE.search(path) else MUTABLE),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        path, encoding = self.negotiate(path, environ)
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        stat = os.stat(path)
+        etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        headers += [
+            ('ETag', etag),
+            ('Last-Modified', formatdate(stat.st_mtime, usegmt=True)),
+            ('Accept-Ranges', 'none' if encoding else 'bytes'),
+        ]
+        if not modified(environ, etag, stat.st_mtime):
+            start_response('304 Not Modified', headers)
+            return []
+        start, end = 0, stat.st_size - 1
+        status = '200 OK'
+        if not encoding and 'HTTP_RANGE' in environ and if_range(
+            environ, etag, stat.st_mtime
+        ):
+            requested = byte_range(environ['HTTP_RANGE'], stat.st_size)
+            if requested is None:
+                headers.append(('Content-Range', f'bytes */{stat.st_size}'))
+                start_response('416 Range Not Satisfiable', headers)
+                return []
+            if requested != (start, end):
+                start, end = requested
+                status = '206 Partial Content'
+                headers.append(
+                    ('Content-Range', f'bytes {start}-{end}/{stat.st_size}')
+                )
+        headers.append(('Content-Length', str(end - start + 1)))
+        start_response(status, headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        file = open(path, 'rb')
+        if status == '206 Partial Content':
+            file.seek(start)
+            return read_range(file, end - start + 1)
+        wrapper = environ.get('wsgi.file_wrapper')
+        if wrapper is not None:
+            return wrapper(file, BLOCK_SIZE)
+        return read_range(file, stat.st_size)
+
+    @staticmethod
+    def negotiate(path, environ):
+        """Сжатая копия файла, если клиент её примет: (путь, кодировка).
+
+        Из принятых кодировок берётся та, у которой больше q, при равных
+        — br раньше gzip.
+        """
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        ranked = sorted(
+            ((accepted.get(encoding, accepted.get('*', 0)), encoding, suffix)
+             for encoding, suffix in ENCODINGS),
+            key=lambda item: -item[0]
+        )
+        for quality, encoding, suffix in ranked:
+            if quality > 0 and os.path.isfile(path + suffix):
+                return path + suffix, encoding
+        return path, None
+
+
+def accepted_encodings(header):
+    """Кодировки из Accept-Encoding с их q: ``{'gzip': 1.0, 'br': 0.0}``."""
+    accepted = {}
+    for item in header.split(','):
+        name, *params = item.split(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def modified(environ, etag, mtime):
+    """False, если у клиента актуальная копия (ответ 304)."""
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag not in tags and '*' not in tags
+    since = parse_http_date(environ.get('HTTP_IF_MODIFIED_SINCE'))
+    return since is None or int(mtime) > since
+
+
+def if_range(environ, etag, mtime):
+    """Можно ли отдать диапазон: файл не менялся с указанной версии."""
+    value = environ.get('HTTP_IF_RANGE')
+    if value is None:
+        return True
+    if value.startswith(('"', 'W/')):
+        return value == etag
+    return parse_http_date(value) == int(mtime)
+
+
+def byte_range(header, size):
+    """(начало, конец) одного диапазона; None, если он вне файла.
+
+    Несколько диапазонов сразу не поддерживаются: отдаётся весь файл.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return 0, size - 1
+    first, last = match.groups()
+    if not first and not last:
+        return 0, size - 1
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+
+def parse_http_date(value):
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def read_range(file, length):
+    with file:
+        while length > 0:
+            chunk = file.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.db.utils import load_backend
+
+
+ENGINES = (
+    ('стандартный', 'django.db.backends.sqlite3'),
+    ('настроенный', 'core.db.backends.sqlite3'),
+)
+
+
+def open_connection(engine, path, timeout):
+    settings_dict = {
+        **connections['default'].settings_dict,
+        'ENGINE': engine,
+        'NAME': path,
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {'timeout': timeout},
+    }
+    return load_backend(engine).DatabaseWrapper(settings_dict, 'benchmark')
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочное сравнение SQLite: стандартный бэкенд против '
+            'core.db.backends.sqlite3 на конкурентных чтениях и записях')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Потоков, читающих ленту')
+        parser.add_argument('--writers', type=int, default=2,
+                            help='Потоков, добавляющих записи')
+        parser.add_argument('--seconds', type=float, default=5,
+                            help='Длительность замера для каждого бэкенда')
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Записей в таблице перед замером')
+        parser.add_argument('--timeout', type=float, default=5,
+                            help='Ожидание блокировки, с')
+
+    def handle(self, *args, **options):
+        for title, engine in ENGINES:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                reads, writes, errors = self.run(engine, path, options)
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{title} ({engine}): '
+                f'чтений {reads / seconds:.0f}/с, '
+                f'записей {writes / seconds:.0f}/с, '
+                f'ошибок блокировки {errors}'
+            )
+
+    def run(self, engine, path, options):
+        setup = open_connection(engine, path, options['timeout'])
+        with setup.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE bench (id INTEGER PRIMARY KEY, '
+                'created REAL, text TEXT)'
+            )
+            cursor.execute('CREATE INDEX bench_created ON bench (created)')
+            cursor.executemany(
+                'INSERT INTO bench (created, text) VALUES (%s, %s)',
+                [(number, 'текст ' * 20) for number in range(options['rows'])]
+            )
+        setup.close()
+        deadline = time.monotonic() + options['seconds']
+        totals = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def work(kind):
+            connection = open_connection(engine, path, options['timeout'])
+            done = errors = 0
+            while time.monotonic() < deadline:
+                try:
+                    with connection.cursor() as cursor:
+                        if kind == 'reads':
+                            cursor.execute(
+                                'SELECT id, text FROM bench '
+                                'ORDER BY created DESC LIMIT 10'
+                            )
+                            cursor.fetchall()
+                        else:
+                            cursor.execute(
+                                'INSERT INTO bench (created, text) '
+                                'VALUES (%s, %s)', [time.time(), 'новая']
+                            )
+                    done += 1
+                except OperationalError:
+                    errors += 1
+            connection.close()
+            with lock:
+                totals[kind] += done
+                totals['errors'] += errors
+
+        threads = [
+            threading.Thread(target=work, args=(kind,))
+            for kind, count in (('reads', options['readers']),
+                                ('writes', options['writers']))
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return totals['reads'], totals['writes'], totals['errors']
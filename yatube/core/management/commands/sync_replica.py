@@ -0,0 +1,26 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файлы реплик '
+            '(DATABASE_REPLICAS) — для проверки реплик на своей машине')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]['NAME']
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не настроены: DJANGO_REPLICA_DB')
+        for alias in settings.DATABASE_REPLICAS:
+            target = settings.DATABASES[alias]['NAME']
+            source = sqlite3.connect(primary)
+            replica = sqlite3.connect(target)
+            try:
+                # онлайн-копия: основная база доступна всё время копирования
+                source.backup(replica)
+            finally:
+                replica.close()
+                source.close()
+            self.stdout.write(self.style.SUCCESS(f'{alias}: {target}'))
@@ -0,0 +1,279 @@
+"""Метрики запросов без debug_toolbar.
+
+``MetricsMiddleware`` считает каждый запрос (представление, метод, код
+ответа, размер ответа), а у доли ``SAMPLE_RATE`` запросов ещё и замеряет
+общее время, время и число запросов к базе, время отрисовки шаблонов
+и обращения к кешу. Замеры копятся в памяти процесса и отдаются
+страницей ``/metrics`` в текстовом формате Prometheus — каждый воркер
+отдаёт свои. Страница открыта только при заданном ``METRICS_TOKEN``
+и только с заголовком ``Authorization: Bearer <токен>``. Каждый
+замеренный запрос пишется строкой JSON в лог ``core.metrics`` на уровне
+INFO.
+
+Время шаблонов замеряет бэкенд ``InstrumentedTemplates``: он
+оборачивает шаблоны верхнего уровня, вложенные входят в их время.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+from .cache import cache_stats
+
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = getattr(settings, 'METRICS_SAMPLE_RATE', 0.05)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+_current = ContextVar('metrics_record', default=None)
+_lock = threading.Lock()
+registry = {}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        registry[name] = self
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        with _lock:
+            samples = list(self.samples())
+        for name, labels, value in samples:
+            yield f'{name}{format_labels(labels)} {float(value)!r}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), value=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        with _lock:
+            counts = self.values.setdefault(
+                labels, [0] * (len(self.buckets) + 1) + [0.0]
+            )
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        for labels, counts in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                yield (f'{self.name}_bucket',
+                       labels + (('le', float(bound)),), count)
+            yield (f'{self.name}_bucket',
+                   labels + (('le', '+Inf'),), counts[-2])
+            yield f'{self.name}_sum', labels, counts[-1]
+            yield f'{self.name}_count', labels, counts[-2]
+
+
+class Callback(Metric):
+    """Значение, которое при выдаче берётся из ``function()``."""
+
+    def __init__(self, name, help, function, kind='gauge'):
+        super().__init__(name, help)
+        self.function = function
+        self.kind = kind
+
+    def samples(self):
+        yield self.name, (), self.function()
+
+
+def callback(name, help, function, kind='gauge'):
+    return Callback(name, help, function, kind)
+
+
+def render():
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in list(registry.values()):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+requests_total = Counter(
+    'yatube_requests_total', 'Обработанные запросы'
+)
+response_bytes = Counter(
+    'yatube_response_bytes_total', 'Отданные байты тела ответа'
+)
+request_seconds = Histogram(
+    'yatube_request_seconds', 'Время обработки запроса', SECONDS_BUCKETS
+)
+db_seconds = Histogram(
+    'yatube_db_seconds', 'Время запросов к базе за запрос', SECONDS_BUCKETS
+)
+db_queries = Histogram(
+    'yatube_db_queries', 'Число запросов к базе за запрос', QUERIES_BUCKETS
+)
+template_seconds = Histogram(
+    'yatube_template_seconds', 'Время отрисовки шаблонов за запрос',
+    SECONDS_BUCKETS
+)
+cache_requests = Counter(
+    'yatube_cache_requests_total',
+    'Обращения к кешу в замеренных запросах'
+)
+callback(
+    'yatube_cache_hits_total', 'Попадания в кеш (все запросы)',
+    lambda: cache_stats.hits, 'counter'
+)
+callback(
+    'yatube_cache_misses_total', 'Промахи кеша (все запросы)',
+    lambda: cache_stats.misses, 'counter'
+)
+
+
+class RequestRecord:
+    """Замеры одного запроса; заодно обёртка запросов к базе."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= SAMPLE_RATE:
+            response = self.get_response(request)
+            self.count(request, response)
+            return response
+        record = RequestRecord()
+        token = _current.set(record)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record))
+                cached = stack.enter_context(cache_stats.track())
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+        size = self.count(request, response)
+        view = view_name(request)
+        labels = (('view', view),)
+        request_seconds.observe(labels, elapsed)
+        db_seconds.observe(labels, record.db_seconds)
+        db_queries.observe(labels, record.queries)
+        template_seconds.observe(labels, record.template_seconds)
+        hits, misses = cached['hits'], cached['misses']
+        cache_requests.inc(labels + (('result', 'hit'),), hits)
+        cache_requests.inc(labels + (('result', 'miss'),), misses)
+        logger.info(json.dumps({
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'seconds': round(elapsed, 6),
+            'db_seconds': round(record.db_seconds, 6),
+            'db_queries': record.queries,
+            'template_seconds': round(record.template_seconds, 6),
+            'cache_hits': hits,
+            'cache_misses': misses,
+            'bytes': size,
+        }, ensure_ascii=False))
+        return response
+
+    @staticmethod
+    def count(request, response):
+        """Считает запрос и возвращает размер тела (None у потоковых)."""
+        requests_total.inc((
+            ('view', view_name(request)),
+            ('method', request.method),
+            ('status', response.status_code),
+        ))
+        if response.streaming:
+            return None
+        size = len(response.content)
+        response_bytes.inc((('view', view_name(request)),), size)
+        return size
+
+
+class TimedTemplate:
+    """Шаблон бэкенда, отрисовка которого замеряется."""
+
+    def __init__(self, template):
+        self._wrapped = template
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def render(self, context=None, request=None):
+        record = _current.get()
+        if record is None:
+            return self._wrapped.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self._wrapped.render(context, request)
+        finally:
+            record.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """Шаблоны Django, время отрисовки которых попадает в метрики."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
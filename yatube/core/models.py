@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 
 
 class CreatedModel(models.Model):
@@ -11,3 +11,34 @@ class CreatedModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class ModifiedModel(models.Model):
+    """Абстрактная модель. Добавляет дату и номер последнего изменения.
+
+    Номер изменения выдаёт приложение, которому принадлежит модель:
+    он растёт с каждым сохранением, так что по нему можно забирать
+    изменения «после N». Сохранение вместе с сигналами идёт в одной
+    транзакции: номер фиксируется только вместе с самой записью.
+    """
+    modified = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+    change_seq = models.BigIntegerField(
+        'Номер изменения',
+        default=0,
+        editable=False,
+        db_index=True
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self
+        )
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
@@ -0,0 +1,102 @@
+"""Бюджет запросов к базе на одну страницу и поиск N+1.
+
+Представление объявляет бюджет декоратором ``query_budget(n)``.
+``QueryBudgetMiddleware`` записывает все запросы к базам за время
+обработки запроса, сравнивает их число с бюджетом и ищет одинаковые
+по форме запросы, повторённые ``N_PLUS_ONE_REPEATS`` и более раз, —
+типичный след N+1. В работе нарушения пишутся в лог предупреждениями,
+а при ``QUERY_BUDGET_STRICT = True`` (его включают тестовый прогон
+``core.test_runner.QueryBudgetTestRunner`` и фикстура
+``strict_query_budget`` в ``tests/conftest.py`` для pytest) запрос падает
+с ``QueryBudgetExceeded``, и тест, который открыл страницу, не проходит.
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+N_PLUS_ONE_REPEATS = getattr(settings, 'QUERY_N_PLUS_ONE_REPEATS', 3)
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+LIST_RE = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """Не больше ``limit`` запросов к базе на один вызов представления."""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def query_shape(sql):
+    """Запрос без значений: одинаковые по смыслу запросы совпадают."""
+    return LIST_RE.sub('(...)', LITERAL_RE.sub('%s', sql))
+
+
+class QueryLog:
+    """Запросы к базе, выполненные за время обработки запроса."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self):
+        """Повторяющиеся формы SELECT-запросов: {форма: сколько раз}."""
+        shapes = Counter(
+            query_shape(sql) for sql in self.queries
+            if sql.lstrip().upper().startswith('SELECT')
+        )
+        return {
+            shape: count for shape, count in shapes.items()
+            if count >= N_PLUS_ONE_REPEATS
+        }
+
+    def problems(self, budget):
+        found = [
+            f'N+1: {count} раз {shape}'
+            for shape, count in self.repeated().items()
+        ]
+        if budget is not None and len(self) > budget:
+            found.insert(0, f'{len(self)} запросов при бюджете {budget}')
+        return found
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            response = self.get_response(request)
+        response.query_log = log
+        problems = log.problems(getattr(request, 'query_budget', None))
+        if problems:
+            message = f'{request.method} {request.path}: ' + '; '.join(
+                problems
+            )
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', None)
@@ -0,0 +1,59 @@
+"""Хранилище статики с хешами в именах и заранее сжатыми копиями."""
+import gzip
+import io
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli — необязательная зависимость
+    brotli = None
+
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.txt', '.json', '.map',
+                '.xml', '.html')
+MIN_SIZE = 256
+
+
+def gzip_compress(content):
+    """gzip без времени в заголовке: одинаковые файлы дают одинаковые копии.
+
+    ``gzip.compress(mtime=...)`` появился только в Python 3.8.
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                       mtime=0) as file:
+        file.write(content)
+    return buffer.getvalue()
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """``collectstatic`` кладёт рядом с файлами ``.gz`` и ``.br`` копии.
+
+    Имена файлов содержат хеш содержимого, поэтому их можно кешировать
+    «навсегда», а сжатые копии отдаёт ``core.fileserver`` без сжатия
+    на лету. Копия пишется, только если она заметно меньше оригинала.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in self.hashed_files.values():
+            if name.endswith(COMPRESSIBLE):
+                self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        if os.path.getsize(path) < MIN_SIZE:
+            return
+        with open(path, 'rb') as file:
+            content = file.read()
+        compressed = {'.gz': gzip_compress(content)}
+        if brotli is not None:
+            compressed['.br'] = brotli.compress(content)
+        for suffix, data in compressed.items():
+            if len(data) < len(content) * 0.95:
+                with open(path + suffix, 'wb') as file:
+                    file.write(data)
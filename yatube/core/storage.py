@@ -0,0 +1,35 @@
+"""Хранилище файлов с адресацией по содержимому."""
+import hashlib
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, где имя файла — SHA-256 его содержимого.
+
+    Файл ``posts/photo.jpg`` ляжет как ``posts/ab/ab12…ef.jpg``: каталог
+    и расширение берутся из предложенного имени. Одинаковые загрузки
+    получают одно имя и хранятся один раз, поэтому удалять файл можно,
+    только когда на него больше никто не ссылается, — это забота
+    владельца поля.
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(
+            posixpath.dirname(name), digest[:2], digest + extension
+        )
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
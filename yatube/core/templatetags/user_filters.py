@@ -7,3 +7,21 @@ register = template.Library()
 @register.filter
 def addclass(field, css):
     return field.as_widget(attrs={'class': css})
+
+
+@register.filter
+def page_window(page, on_each_side=2):
+    """Номера страниц вокруг текущей, первая и последняя.
+
+    Разрывы обозначаются ``None``, чтобы шаблон не выводил ссылки
+    на все страницы длинной ленты.
+    """
+    last = page.paginator.num_pages
+    start = max(page.number - on_each_side, 1)
+    end = min(page.number + on_each_side, last)
+    window = list(range(start, end + 1))
+    if start > 1:
+        window = [1] + ([None] if start > 2 else []) + window
+    if end < last:
+        window = window + ([None] if end < last - 1 else []) + [last]
+    return window
@@ -0,0 +1,26 @@
+"""Тестовый прогон проекта.
+
+Отдельно от ``core.querybudget``, чтобы в работе не импортировался
+``django.test``.
+"""
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Тестовый прогон, в котором превышение бюджета роняет тест.
+
+    Кеш на время прогона — ``TEST_CACHES``, а не файл разработки.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(
+            QUERY_BUDGET_STRICT=True, CACHES=settings.TEST_CACHES
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
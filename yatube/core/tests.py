@@ -1,9 +1,439 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.contrib.auth import get_user_model
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings
+)
+from django.test.runner import DiscoverRunner
 from http import HTTPStatus
 
+from .cache import (
+    SQLiteCache, cache_stats, get_or_recompute, invalidate_namespace,
+    namespace_prefix
+)
+from .db.backends.sqlite3 import base as sqlite_base
+from .db.routers import (
+    STICKY_COOKIE, ReplicaMiddleware, ReplicaRouter, primary_reads,
+    reads_from_replica, used_replica
+)
+from . import metrics
+from .fileserver import FileServer
+from .management.commands.sqlite_benchmark import open_connection
+from .querybudget import (
+    QueryBudgetExceeded, QueryBudgetMiddleware, query_budget, query_shape
+)
+from .staticfiles import CompressedManifestStaticFilesStorage, gzip_compress
+from .storage import ContentAddressedStorage
+from .test_runner import QueryBudgetTestRunner
+
 
 class ViewTestClass(TestCase):
     def test_not_found_page(self):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(path, {'KEY_PREFIX': 'test'})
+        self.other = SQLiteCache(path, {'KEY_PREFIX': 'test'})
+
+    def test_values_are_shared_between_connections(self):
+        self.cache.set('key', {'a': [1, 2]})
+        self.cache.set_many({'x': 1, 'y': 'два'})
+        self.assertEqual(self.other.get('key'), {'a': [1, 2]})
+        self.assertEqual(
+            self.other.get_many(['x', 'y', 'z']), {'x': 1, 'y': 'два'}
+        )
+        self.other.delete_many(['x', 'y'])
+        self.assertIsNone(self.cache.get('x'))
+
+    def test_add_and_expiry(self):
+        self.assertTrue(self.cache.add('key', 1, 100))
+        self.assertFalse(self.other.add('key', 2, 100))
+        self.cache.set('key', 1, -1)
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.other.add('key', 2, 100))
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_expired_entries_are_found_by_index(self):
+        plan = self.cache._db.execute(
+            'EXPLAIN QUERY PLAN DELETE FROM cache WHERE expires <= ?', (0,)
+        ).fetchall()
+        self.assertIn('USING INDEX cache_expires', plan[0][-1])
+
+    def test_incr(self):
+        self.cache.set('counter', 10)
+        self.assertEqual(self.other.incr('counter', 5), 15)
+        self.assertEqual(self.cache.decr('counter'), 14)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+
+class CacheHelpersTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_invalidate_namespace_changes_prefix(self):
+        prefix = namespace_prefix('feed')
+        self.assertEqual(namespace_prefix('feed'), prefix)
+        invalidate_namespace('feed')
+        self.assertNotEqual(namespace_prefix('feed'), prefix)
+
+    def test_get_or_recompute_computes_once(self):
+        compute = mock.Mock(return_value='value')
+        self.assertEqual(get_or_recompute('key', compute, 100), 'value')
+        self.assertEqual(get_or_recompute('key', compute, 100), 'value')
+        compute.assert_called_once()
+
+    def test_stale_value_is_served_while_another_worker_recomputes(self):
+        get_or_recompute('key', lambda: 'old', 100)
+        cache.add('key:lock', True)
+        compute = mock.Mock(return_value='new')
+        value = get_or_recompute(
+            'key', compute, 100, is_fresh=lambda value: False
+        )
+        self.assertEqual(value, 'old')
+        compute.assert_not_called()
+        cache.delete('key:lock')
+        value = get_or_recompute(
+            'key', compute, 100, is_fresh=lambda value: False
+        )
+        self.assertEqual(value, 'new')
+
+
+class ContentAddressedStorageTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+
+    def test_identical_files_are_stored_once(self):
+        first = self.storage.save('posts/a.JPG', ContentFile(b'photo'))
+        second = self.storage.save('posts/b.jpg', ContentFile(b'photo'))
+        other = self.storage.save('posts/c.jpg', ContentFile(b'other'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, r'^posts/([0-9a-f]{2})/\1[0-9a-f]{62}\.jpg$')
+        self.assertEqual(len(self.storage.listdir('posts')[0]), 2)
+
+
+class FileServerTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.content = b'body { color: red; }' * 20
+        self.write(directory.name, 'site.0123456789ab.css', self.content)
+        self.write(directory.name, 'site.0123456789ab.css.gz',
+                   gzip.compress(self.content))
+        self.server = FileServer(self.application,
+                                 [('/static/', directory.name)])
+
+    @staticmethod
+    def write(directory, name, content):
+        with open(os.path.join(directory, name), 'wb') as file:
+            file.write(content)
+
+    @staticmethod
+    def application(environ, start_response):
+        start_response('404 Not Found', [])
+        return [b'django']
+
+    def get(self, path='/static/site.0123456789ab.css', **headers):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+        environ.update(
+            (f'HTTP_{name.upper()}', value) for name, value in headers.items()
+        )
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        response['body'] = b''.join(self.server(environ, start_response))
+        return response
+
+    def test_full_file_with_far_future_headers(self):
+        res = self.get()
+        self.assertEqual(res['status'], '200 OK')
+        self.assertEqual(res['body'], self.content)
+        self.assertIn('immutable', res['headers']['Cache-Control'])
+
+    def test_conditional_get(self):
+        etag = self.get()['headers']['ETag']
+        res = self.get(if_none_match=etag)
+        self.assertEqual(res['status'], '304 Not Modified')
+        self.assertEqual(res['body'], b'')
+
+    def test_precompressed_copy(self):
+        res = self.get(accept_encoding='gzip, deflate')
+        self.assertEqual(res['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res['body']), self.content)
+
+    def test_refused_encoding_is_not_sent(self):
+        for header in ('gzip;q=0', 'br, gzip; q=0', 'identity', '*;q=0'):
+            with self.subTest(header=header):
+                res = self.get(accept_encoding=header)
+                self.assertNotIn('Content-Encoding', res['headers'])
+                self.assertEqual(res['body'], self.content)
+        res = self.get(accept_encoding='*')
+        self.assertEqual(res['headers']['Content-Encoding'], 'gzip')
+
+    def test_range(self):
+        res = self.get(range='bytes=5-9')
+        self.assertEqual(res['status'], '206 Partial Content')
+        self.assertEqual(res['body'], self.content[5:10])
+        self.assertEqual(res['headers']['Content-Range'],
+                         f'bytes 5-9/{len(self.content)}')
+        res = self.get(range=f'bytes={len(self.content)}-')
+        self.assertEqual(res['status'], '416 Range Not Satisfiable')
+
+    def test_unknown_and_unsafe_paths_go_to_application(self):
+        for path in ('/static/missing.css', '/static/../tests.py', '/other/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path)['body'], b'django')
+
+
+class CompressedStaticFilesTest(SimpleTestCase):
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(
+            STATIC_ROOT=directory.name,
+            STATICFILES_STORAGE=(
+                'core.staticfiles.CompressedManifestStaticFilesStorage'
+            ),
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            storage = CompressedManifestStaticFilesStorage()
+            name = storage.stored_name('css/bootstrap.min.css')
+        self.assertRegex(name, r'^css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        self.assertTrue(
+            os.path.exists(os.path.join(directory.name, name + '.gz'))
+        )
+
+    def test_gzip_copy_has_no_timestamp(self):
+        content = b'body { color: red; }' * 20
+        compressed = gzip_compress(content)
+        self.assertEqual(compressed[4:8], bytes(4))
+        self.assertEqual(gzip.decompress(compressed), content)
+
+
+class TunedSQLiteTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
+
+    def test_connection_gets_pragmas(self):
+        connection = open_connection('core.db.backends.sqlite3', self.path, 1)
+        self.addCleanup(connection.close)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_locked_query_is_retried(self):
+        connection = open_connection('core.db.backends.sqlite3', self.path, 1)
+        self.addCleanup(connection.close)
+        locked = sqlite3.OperationalError('database is locked')
+        parent = sqlite_base.base.SQLiteCursorWrapper
+        with mock.patch.object(sqlite_base, 'RETRY_DELAY', 0), \
+                mock.patch.object(parent, 'execute',
+                                  side_effect=[locked, locked, None]) as run:
+            connection.cursor().execute('SELECT 1')
+        self.assertEqual(run.call_count, 3)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('sqlite_benchmark', seconds=0.1, rows=10,
+                     readers=1, writers=1, stdout=out)
+        self.assertIn('core.db.backends.sqlite3', out.getvalue())
+
+
+def read_alias(request):
+    return HttpResponse(ReplicaRouter().db_for_read(None))
+
+
+@reads_from_replica
+def feed(request):
+    return read_alias(request)
+
+
+@reads_from_replica
+def feed_for_cache(request):
+    with primary_reads():
+        alias = ReplicaRouter().db_for_read(None)
+    return HttpResponse(f'{alias} {used_replica()}')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def handle(self, request, view):
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+        middleware = ReplicaMiddleware(get_response)
+        return middleware(request)
+
+    def test_marked_views_read_from_replica(self):
+        res = self.handle(self.factory.get('/'), feed)
+        self.assertEqual(res.content, b'replica')
+        res = self.handle(self.factory.get('/'), read_alias)
+        self.assertEqual(res.content, b'default')
+        self.assertEqual(self.router.db_for_read(None), 'default')
+
+    def test_reads_for_caches_go_to_primary(self):
+        res = self.handle(self.factory.get('/'), feed_for_cache)
+        self.assertEqual(res.content, b'default False')
+
+    def test_writer_sticks_to_primary(self):
+        res = self.handle(self.factory.post('/'), read_alias)
+        self.assertIn(STICKY_COOKIE, res.cookies)
+        request = self.factory.get('/')
+        request.COOKIES[STICKY_COOKIE] = '1'
+        self.assertEqual(self.handle(request, feed).content, b'default')
+
+    def test_writes_and_migrations_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_write(None), 'default')
+        self.assertFalse(self.router.allow_migrate('replica', 'posts'))
+
+
+@query_budget(2)
+def users_one_by_one(request):
+    User = get_user_model()
+    names = [User.objects.get(pk=pk).username
+             for pk in User.objects.values_list('pk', flat=True)]
+    return HttpResponse(' '.join(names))
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('a', 'b', 'c'):
+            get_user_model().objects.create_user(name)
+
+    def handle(self, view):
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+        middleware = QueryBudgetMiddleware(get_response)
+        return middleware(RequestFactory().get('/users/'))
+
+    def test_shapes_ignore_values(self):
+        self.assertEqual(
+            query_shape("SELECT * FROM t WHERE a = 'x' AND b IN (1, 2, 3)"),
+            query_shape("SELECT * FROM t WHERE a = 'y' AND b IN (%s, %s)")
+        )
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_mode_fails_on_overrun_and_n_plus_one(self):
+        with self.assertRaises(QueryBudgetExceeded) as error:
+            self.handle(users_one_by_one)
+        self.assertIn('4 запросов при бюджете 2', str(error.exception))
+        self.assertIn('N+1: 3 раз', str(error.exception))
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_production_only_logs(self):
+        with self.assertLogs('core.querybudget', 'WARNING') as logs:
+            res = self.handle(users_one_by_one)
+        self.assertEqual(res.content, b'a b c')
+        self.assertEqual(len(res.query_log), 4)
+        self.assertIn('GET /users/', logs.output[0])
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_runner_restores_settings(self):
+        runner = QueryBudgetTestRunner()
+        with mock.patch.object(DiscoverRunner, 'setup_test_environment'), \
+                mock.patch.object(DiscoverRunner, 'teardown_test_environment'):
+            runner.setup_test_environment()
+            self.assertTrue(settings.QUERY_BUDGET_STRICT)
+            self.assertEqual(settings.CACHES, settings.TEST_CACHES)
+            runner.teardown_test_environment()
+        self.assertFalse(settings.QUERY_BUDGET_STRICT)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_sampled_request_is_logged_and_exported(self):
+        with mock.patch.object(metrics, 'SAMPLE_RATE', 1.0), \
+                self.assertLogs('core.metrics', 'INFO') as logs:
+            self.client.get('/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'posts:index')
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['template_seconds'], 0)
+        self.assertGreater(record['bytes'], 0)
+        with self.settings(METRICS_TOKEN='secret'):
+            res = self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+            )
+        self.assertEqual(res.status_code, HTTPStatus.OK)
+        text = res.content.decode()
+        self.assertIn(
+            'yatube_requests_total{view="posts:index",method="GET",'
+            'status="200"}', text
+        )
+        self.assertIn(
+            'yatube_db_queries_bucket{view="posts:index",le="+Inf"}', text
+        )
+        self.assertIn('# TYPE yatube_card_cache_hit_ratio gauge', text)
+
+    def test_cache_hits_and_misses_are_counted_for_any_backend(self):
+        hits, misses = cache_stats.hits, cache_stats.misses
+        with cache_stats.track() as counts:
+            cache.set('key', 0)
+            cache.get('key')
+            cache.get('missing')
+            cache.get_many(['key', 'missing'])
+        self.assertEqual(counts, {'hits': 2, 'misses': 2})
+        self.assertEqual(
+            (cache_stats.hits - hits, cache_stats.misses - misses), (2, 2)
+        )
+
+    def test_unsampled_request_is_only_counted(self):
+        labels = (('view', 'about:author'), ('method', 'GET'),
+                  ('status', 200))
+        before = metrics.requests_total.values.get(labels, 0)
+        with mock.patch.object(metrics, 'SAMPLE_RATE', 0.0), \
+                mock.patch.object(metrics.logger, 'info') as info:
+            self.client.get('/about/author/')
+        info.assert_not_called()
+        self.assertEqual(metrics.requests_total.values[labels], before + 1)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_off_without_token(self):
+        res = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(res.status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_proxied_request_without_token_is_rejected(self):
+        # за прокси на той же машине адрес клиента всегда 127.0.0.1
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'}):
+            res = self.client.get(
+                '/metrics', REMOTE_ADDR='127.0.0.1',
+                HTTP_X_FORWARDED_FOR='10.1.2.3', **headers
+            )
+            self.assertEqual(res.status_code, HTTPStatus.FORBIDDEN)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Post, Group
+from . import search
+from .models import AuthorStats, Post, Group
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -9,6 +10,24 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('created',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по полнотекстовому индексу вместо LIKE '%...%'."""
+        if not search.available() or not search.fts_query(search_term):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return search.filter_matching(queryset, search_term), False
+
+
+class AuthorStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        'author', 'posts_count', 'followers_count', 'following_count',
+        'comments_count'
+    )
+    search_fields = ('author__username',)
+    readonly_fields = list_display
+
 
 admin.site.register(Post, PostAdmin)
+admin.site.register(AuthorStats, AuthorStatsAdmin)
 admin.site.register(Group)
@@ -0,0 +1,216 @@
+"""JSON API лент для чтения, версия 1 (``/api/v1/``).
+
+Посты выбираются через ``.values()``, без создания моделей, и только
+с полями, перечисленными в ``?fields=id,text,author`` (по умолчанию —
+все из ``FIELDS``). Страницы листаются по курсору: ``next`` из ответа
+передаётся как ``?cursor=``.
+
+Выгрузка ``posts/export/`` отдаётся потоком NDJSON. Посты читаются
+пачками по ``EXPORT_CHUNK`` по ключу (created, id), поэтому память
+воркера не зависит от размера выгрузки.
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from core.db.routers import reads_from_replica
+from core.querybudget import query_budget
+
+from .models import Group, Post, User
+from .paginators import CursorPaginator
+from . import caching, counters, timeline
+
+
+PER_PAGE = getattr(settings, 'POSTS_API_PER_PAGE', 20)
+EXPORT_CHUNK = getattr(settings, 'POSTS_API_EXPORT_CHUNK', 1000)
+
+FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'created': 'created',
+    'modified': 'modified',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+}
+# нужны курсору и областям кеша, даже если их не просили
+KEY_COLUMNS = ('id', 'created', 'author_id', 'group_id')
+IMAGE_STORAGE = Post._meta.get_field('image').storage
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def requested_fields(request):
+    """Поля из ``?fields=``; ValueError, если среди них есть неизвестные."""
+    value = request.GET.get('fields', '')
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f'неизвестные поля: {", ".join(unknown)}')
+    return fields or list(FIELDS)
+
+
+def select(queryset, fields):
+    columns = {FIELDS[name] for name in fields}.union(KEY_COLUMNS)
+    return queryset.values(*columns)
+
+
+def serialize(row, fields):
+    item = {name: row[FIELDS[name]] for name in fields}
+    if item.get('image'):
+        item['image'] = IMAGE_STORAGE.url(item['image'])
+    elif 'image' in item:
+        item['image'] = None
+    return item
+
+
+def row_scopes(rows):
+    """Области кеша страниц (``caching``) для строк ``.values()``."""
+    scopes = {caching.author_scope(row['author_id']) for row in rows}
+    scopes.update(
+        caching.group_scope(row['group_id'])
+        for row in rows if row['group_id'] is not None
+    )
+    return scopes
+
+
+def feed_response(request, queryset, feeds, *scopes):
+    """Страница ленты по курсору: ``count``, ``next``, ``results``."""
+    try:
+        fields = requested_fields(request)
+    except ValueError as exc:
+        return error(str(exc))
+    paginator = CursorPaginator(select(queryset, fields), PER_PAGE,
+                                feeds=feeds)
+    page = paginator.get_page(
+        request.GET.get('page'), request.GET.get('cursor')
+    )
+    caching.depends_on(request, *scopes, *row_scopes(page))
+    return JsonResponse({
+        'count': paginator.count,
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+        'results': [serialize(row, fields) for row in page],
+    })
+
+
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
+def index(request):
+    """Лента всех постов"""
+    return feed_response(
+        request, Post.objects.all(), [counters.INDEX_FEED],
+        caching.INDEX_SCOPE
+    )
+
+
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
+def group_posts(request, slug):
+    """Посты группы"""
+    group = get_object_or_404(Group.objects.only('pk'), slug=slug)
+    return feed_response(
+        request, group.post_set.all(), [counters.group_feed(group.pk)],
+        caching.group_scope(group.pk)
+    )
+
+
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
+def profile(request, username):
+    """Посты автора"""
+    author = get_object_or_404(User.objects.only('pk'), username=username)
+    return feed_response(
+        request, author.posts.all(), [counters.author_feed(author.pk)],
+        caching.author_scope(author.pk)
+    )
+
+
+@query_budget(7)
+@reads_from_replica
+def follow_index(request):
+    """Лента подписок вошедшего пользователя"""
+    if not request.user.is_authenticated:
+        return error('нужно войти', status=401)
+    follower = list(
+        request.user.follower.values_list('author_id', flat=True)
+    )
+    if timeline.enabled():
+        post_list = timeline.feed(request.user)
+        feeds = timeline.feeds(request.user, follower)
+    else:
+        post_list = Post.objects.filter(author__in=follower)
+        feeds = [counters.author_feed(pk) for pk in follower]
+    return feed_response(request, post_list, feeds)
+
+
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
+def post_detail(request, post_id):
+    """Один пост"""
+    try:
+        fields = requested_fields(request)
+    except ValueError as exc:
+        return error(str(exc))
+    row = select(Post.objects.filter(pk=post_id), fields).first()
+    if row is None:
+        return error('пост не найден', status=404)
+    caching.depends_on(
+        request, caching.post_scope(post_id), *row_scopes([row])
+    )
+    return JsonResponse(serialize(row, fields))
+
+
+def export_lines(queryset, fields):
+    """Строки NDJSON всех постов, от новых к старым, пачками по ключу."""
+    queryset = select(queryset, fields).order_by('-created', '-pk')
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    position = Q()
+    while True:
+        rows = list(queryset.filter(position)[:EXPORT_CHUNK])
+        for row in rows:
+            yield encoder.encode(serialize(row, fields)) + '\n'
+        if len(rows) < EXPORT_CHUNK:
+            return
+        last = rows[-1]
+        position = (Q(created__lt=last['created'])
+                    | Q(created=last['created'], pk__lt=last['id']))
+
+
+@query_budget(4)
+def export(request):
+    """Выгрузка постов потоком NDJSON; ``?group=`` и ``?author=``"""
+    try:
+        fields = requested_fields(request)
+    except ValueError as exc:
+        return error(str(exc))
+    post_list = Post.objects.all()
+    if request.GET.get('group'):
+        group = get_object_or_404(
+            Group.objects.only('pk'), slug=request.GET['group']
+        )
+        post_list = post_list.filter(group=group)
+    if request.GET.get('author'):
+        author = get_object_or_404(
+            User.objects.only('pk'), username=request.GET['author']
+        )
+        post_list = post_list.filter(author=author)
+    # пачки читаются уже после выхода из представления — с основной базы
+    response = StreamingHttpResponse(
+        export_lines(post_list, fields),
+        content_type='application/x-ndjson; charset=utf-8'
+    )
+    response['Content-Disposition'] = 'attachment; filename="posts.ndjson"'
+    return response
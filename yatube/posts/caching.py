@@ -0,0 +1,257 @@
+"""Кеширование отрисованных фрагментов и целых страниц, условные GET."""
+import hashlib
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
+
+from core import metrics
+from core.cache import CacheStats, get_or_recompute, namespace_prefix
+from core.db.routers import primary_reads, reading_from_replica, used_replica
+
+from . import thumbnails
+
+
+CARD_TIMEOUT = getattr(settings, 'POSTS_CARD_TIMEOUT', 60 * 60 * 24)
+PAGE_TIMEOUT = getattr(settings, 'POSTS_PAGE_TIMEOUT', 60 * 10)
+CARD_TEMPLATE = 'includes/article.html'
+
+card_stats = CacheStats('card_tracked')
+
+
+CARD_NAMESPACE = 'posts:card'
+
+
+def card_keys(post_id, prefix=None):
+    """Ключи карточки поста: со ссылкой на группу и без неё."""
+    prefix = prefix or namespace_prefix(CARD_NAMESPACE)
+    return [f'{prefix}:{post_id}:{variant}' for variant in (0, 1)]
+
+
+def card_fingerprint(post):
+    """То, что попадает в карточку не из самого поста.
+
+    Изменения поста сбрасывают карточку сигналом, а смену имени автора
+    или адреса группы карточка замечает по отпечатку. Манифест вариантов
+    картинки пишется в фоне мимо сигналов, поэтому он тоже в отпечатке.
+    """
+    group_slug = post.group.slug if post.group_id else None
+    return (post.author.username, post.author.get_full_name(), group_slug,
+            post.image_variants)
+
+
+def render_cards(posts, hide_group_link=False):
+    """Карточки постов страницы ленты: одно чтение кеша на всю страницу.
+
+    Миниатюры для карточек, которых нет в кеше, ищутся разом. Посты,
+    прочитанные с реплики, могут отставать — их карточки не кешируются.
+    """
+    variant = int(hide_group_link)
+    prefix = namespace_prefix(CARD_NAMESPACE)
+    keys = {post.pk: card_keys(post.pk, prefix)[variant] for post in posts}
+    cached = cache.get_many(keys.values())
+    cards, stale = {}, []
+    for post in posts:
+        entry = cached.get(keys[post.pk])
+        if entry is not None and entry[0] == card_fingerprint(post):
+            card_stats.count(1, 0)
+            cards[post.pk] = entry[1]
+        else:
+            card_stats.count(0, 1)
+            stale.append(post)
+    thumbnails.attach(stale)
+    missed = {}
+    for post in stale:
+        cards[post.pk] = render_to_string(
+            CARD_TEMPLATE, {'post': post, 'title': hide_group_link}
+        )
+        missed[keys[post.pk]] = (card_fingerprint(post), cards[post.pk])
+    if missed and not reading_from_replica():
+        cache.set_many(missed, CARD_TIMEOUT)
+    return [mark_safe(cards[post.pk]) for post in posts]
+
+
+metrics.callback(
+    'yatube_card_cache_hit_ratio', 'Доля карточек постов, взятых из кеша',
+    card_stats.ratio
+)
+
+
+def forget_card(post_id):
+    cache.delete_many(card_keys(post_id))
+
+
+# Кеш страниц для анонимных пользователей.
+#
+# Страница зависит от «областей»: ``index`` — лента всех постов,
+# ``post:<id>``, ``author:<id>``, ``group:<id>``. У каждой области в кеше
+# есть версия — время последнего изменения, которое сдвигают сигналы.
+# Вместе со страницей хранятся версии её областей на момент отрисовки:
+# если хоть одна изменилась, страница отрисовывается заново.
+
+INDEX_SCOPE = 'index'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def scopes_of(posts):
+    """Области авторов и групп постов, показанных на странице."""
+    scopes = set()
+    for post in posts:
+        scopes.add(author_scope(post.author_id))
+        if post.group_id is not None:
+            scopes.add(group_scope(post.group_id))
+    return scopes
+
+
+def version_key(scope):
+    return f'posts:version:{scope}'
+
+
+def scope_versions(scopes):
+    """Текущие версии областей; отсутствующие заводятся заново."""
+    keys = {version_key(scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    for key, stamp in missing.items():
+        cache.add(key, stamp, None)
+    versions.update(missing)
+    return {keys[key]: stamp for key, stamp in versions.items()}
+
+
+def touch(*scopes):
+    """Отмечает изменение областей: их страницы устаревают."""
+    stamp = time.time()
+    cache.set_many({version_key(scope): stamp for scope in scopes}, None)
+
+
+def depends_on(request, *scopes):
+    """Вызывается представлением: от чего зависит отрисованная страница."""
+    request.page_scopes = getattr(request, 'page_scopes', set())
+    request.page_scopes.update(scopes)
+
+
+def page_key(request):
+    parts = (
+        request.path,
+        request.GET.get('page', ''),
+        request.GET.get('cursor', ''),
+        request.GET.get('format', ''),
+        request.GET.get('fields', ''),
+    )
+    digest = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    return f'posts:page:{digest}'
+
+
+def cache_anonymous_page(view):
+    """Кеширует страницы, которые отдаются анонимным пользователям.
+
+    Представление должно сообщить о своих областях через ``depends_on``.
+    Устаревшую страницу перерисовывает один процесс, остальные до тех пор
+    отдают прежнюю копию (см. ``core.cache.get_or_recompute``). Страница
+    для кеша читается с основной базы: отстающая реплика записала бы
+    старые строки под новыми версиями областей.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+        rendered = {}
+
+        def render():
+            with primary_reads():
+                response = view(request, *args, **kwargs)
+            rendered['response'] = response
+            scopes = getattr(request, 'page_scopes', None)
+            if (response.status_code != 200 or not scopes
+                    or response.cookies):
+                return None
+            return (
+                scope_versions(scopes),
+                response.content,
+                response['Content-Type'],
+            )
+
+        entry = get_or_recompute(
+            page_key(request), render, PAGE_TIMEOUT,
+            is_fresh=lambda entry: scope_versions(entry[0]) == entry[0]
+        )
+        if 'response' in rendered:
+            return rendered['response']
+        versions, content, content_type = entry
+        depends_on(request, *versions)
+        return HttpResponse(content, content_type=content_type)
+    return wrapper
+
+
+def page_validators(request, versions):
+    """ETag и Last-Modified страницы по версиям её областей.
+
+    Страница вошедшего пользователя отличается от чужой (кнопки, форма
+    комментария), поэтому пользователь входит в ETag. Last-Modified
+    точен до секунды, поэтому время изменения округляется вверх.
+    """
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    state = repr((user_id, sorted(versions.items())))
+    etag = quote_etag(hashlib.md5(state.encode()).hexdigest())
+    return etag, math.ceil(max(versions.values()))
+
+
+def conditional_page(view):
+    """Отвечает 304 на повторный запрос страницы, которая не менялась.
+
+    Представление сообщает свои области через ``depends_on``; они
+    запоминаются для адреса страницы, так что в следующий раз валидаторы
+    считаются по версиям областей ещё до запуска представления — без
+    запросов пагинатора и отрисовки шаблонов. Last-Modified выдаётся,
+    только когда секунда изменения прошла: иначе изменение в ту же
+    секунду получило бы ту же дату. Страница, прочитанная с реплики,
+    может отставать от версий — валидаторов у неё нет.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        scopes_key = f'{page_key(request)}:scopes'
+        scopes = cache.get(scopes_key)
+        if scopes:
+            etag, modified = page_validators(request, scope_versions(scopes))
+            response = get_conditional_response(
+                request, etag=etag, last_modified=modified
+            )
+            if response is not None:
+                response['ETag'] = etag
+                return response
+        response = view(request, *args, **kwargs)
+        scopes = getattr(request, 'page_scopes', None)
+        if response.status_code != 200 or not scopes:
+            return response
+        cache.set(scopes_key, sorted(scopes), PAGE_TIMEOUT)
+        etag, modified = page_validators(request, scope_versions(scopes))
+        if not used_replica():
+            response['ETag'] = etag
+            if time.time() >= modified:
+                response['Last-Modified'] = http_date(modified)
+        patch_cache_control(
+            response, no_cache=True, private=request.user.is_authenticated
+        )
+        return response
+    return wrapper
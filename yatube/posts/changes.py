@@ -0,0 +1,101 @@
+"""Номера изменений и выборка изменений «после N».
+
+Каждое сохранение группы, поста или комментария получает следующий номер
+изменения (``change_seq``) из журнала ``Change``, удаление оставляет
+в журнале запись с ``deleted``. ``since(N)`` отдаёт всё, что изменилось
+после N, по возрастанию номеров: потребитель запоминает последний номер
+и в следующий раз спрашивает с него. Объект, изменённый несколько раз,
+попадает в выдачу один раз — с последним номером. Каждая выборка идёт
+по индексу и ограничена ``limit``.
+
+Номер выдаётся в той же транзакции, что и сама запись (транзакции
+SQLite начинаются с ``BEGIN IMMEDIATE``), поэтому изменения фиксируются
+в порядке номеров и опрашивающий не перескочит ещё не видимый номер.
+В журнале остаются только записи удалений: остальные стираются сразу
+после выдачи номера, а AUTOINCREMENT не выдаёт номера повторно.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Change, Comment, Group, Post
+
+
+CHANGES_LIMIT = getattr(settings, 'POSTS_CHANGES_LIMIT', 500)
+TRACKED = {model._meta.model_name: model for model in (Group, Post, Comment)}
+
+Entry = namedtuple('Entry', 'seq model id deleted modified')
+
+
+def allocate(model, object_id=None, deleted=False):
+    """Следующий номер изменения объекта ``object_id`` модели ``model``.
+
+    Вызывается внутри транзакции, которая записывает сам объект.
+    """
+    number = Change.objects.create(
+        model=model._meta.model_name, object_id=object_id, deleted=deleted
+    ).pk
+    if not deleted:
+        Change.objects.filter(pk=number).delete()
+    return number
+
+
+def allocate_many(model, count):
+    """``count`` номеров подряд для пачки новых объектов ``bulk_create``.
+
+    Вызывается внутри транзакции: SQLite держит блокировку записи до её
+    конца, поэтому номера, выданные пачке, идут подряд.
+    """
+    if not count:
+        return []
+    Change.objects.bulk_create(
+        Change(model=model._meta.model_name) for _ in range(count)
+    )
+    last = Change.objects.aggregate(last=Max('pk'))['last']
+    Change.objects.filter(pk__gt=last - count, deleted=False).delete()
+    return list(range(last - count + 1, last + 1))
+
+
+def update(queryset, **fields):
+    """``queryset.update(**fields)`` с новыми номерами и датой изменения.
+
+    Для записей в обход ``save()``: каждая строка получает свой номер
+    в одной транзакции с самим изменением.
+    """
+    model = queryset.model
+    with transaction.atomic():
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        numbers = allocate_many(model, len(ids))
+        now = timezone.now()
+        model.objects.bulk_update(
+            [model(pk=pk, change_seq=number, modified=now, **fields)
+             for pk, number in zip(ids, numbers)],
+            ['change_seq', 'modified', *fields], batch_size=500
+        )
+
+
+def since(seq, limit=CHANGES_LIMIT):
+    """Изменения с номерами больше ``seq``, не больше ``limit`` штук."""
+    entries = []
+    for name, model in TRACKED.items():
+        rows = (
+            model.objects.filter(change_seq__gt=seq).order_by('change_seq')
+            .values_list('change_seq', 'pk', 'modified')[:limit]
+        )
+        entries.extend(
+            Entry(number, name, pk, False, modified)
+            for number, pk, modified in rows
+        )
+    deletions = (
+        Change.objects.filter(deleted=True, pk__gt=seq)
+        .values_list('pk', 'model', 'object_id')[:limit]
+    )
+    entries.extend(
+        Entry(number, name, pk, True, None)
+        for number, name, pk in deletions
+    )
+    entries.sort()
+    return entries[:limit]
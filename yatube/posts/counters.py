@@ -0,0 +1,112 @@
+"""Кешированные счётчики постов в лентах и комментариев к постам.
+
+Лента обозначается ключом: ``index`` — все посты, ``group:<id>`` — посты
+группы, ``author:<id>`` — посты автора, ``comments:<id>`` — комментарии
+к посту, ``timeline:<id>`` — входящие ленты подписок (``timeline``).
+Значения живут в кеше и поддерживаются сигналами создания
+и удаления постов и комментариев, поэтому пагинатору
+не нужен ``SELECT COUNT(*)`` на каждый запрос. Если счётчика в кеше нет,
+он считается заново, но не дальше ``COUNT_ESTIMATE_THRESHOLD`` строк:
+для более длинных лент берётся оценка. Счётчик, посчитанный на реплике,
+может отставать и в кеш не попадает. Входящие не кешируются: они
+ограничены ``TIMELINE_SIZE`` и считаются по индексу, а меняются при
+каждой раздаче поста.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from core.db.routers import reading_from_replica
+
+from .models import Comment, Post, TimelineEntry
+
+
+COUNT_TIMEOUT = getattr(settings, 'POSTS_COUNT_TIMEOUT', 60 * 60)
+COUNT_ESTIMATE_THRESHOLD = getattr(
+    settings, 'POSTS_COUNT_ESTIMATE_THRESHOLD', 10000
+)
+
+INDEX_FEED = 'index'
+
+
+def group_feed(group_id):
+    return f'group:{group_id}'
+
+
+def author_feed(author_id):
+    return f'author:{author_id}'
+
+
+def comments_feed(post_id):
+    return f'comments:{post_id}'
+
+
+def timeline_feed(user_id):
+    return f'timeline:{user_id}'
+
+
+def cache_key(feed):
+    return f'posts:count:{feed}'
+
+
+def feed_queryset(feed):
+    """Посты (или комментарии), которые входят в ленту ``feed``."""
+    if feed == INDEX_FEED:
+        return Post.objects.all()
+    kind, pk = feed.split(':')
+    if kind == 'comments':
+        return Comment.objects.filter(post_id=pk)
+    if kind == 'timeline':
+        return TimelineEntry.objects.filter(user_id=pk)
+    if kind == 'group':
+        return Post.objects.filter(group_id=pk)
+    return Post.objects.filter(author_id=pk)
+
+
+def feed_count(feeds):
+    """Суммарное число постов в лентах ``feeds`` (одно чтение из кеша)."""
+    keys = {cache_key(feed): feed for feed in feeds}
+    counts = cache.get_many(keys)
+    for key, feed in keys.items():
+        if key not in counts:
+            counts[key] = bounded_count(feed_queryset(feed))
+            if reading_from_replica() or feed.startswith('timeline:'):
+                continue
+            cache.add(key, counts[key], COUNT_TIMEOUT)
+    return sum(counts.values())
+
+
+def bounded_count(queryset):
+    """Точный COUNT до порога, выше порога — оценка по диапазону id."""
+    # порядок не важен: без него SQLite считает по покрывающему индексу
+    capped = queryset.order_by()[:COUNT_ESTIMATE_THRESHOLD].count()
+    if capped < COUNT_ESTIMATE_THRESHOLD:
+        return capped
+    queryset = queryset.order_by('-pk')
+    ids = queryset.values_list('pk', flat=True)
+    newest = ids.first()
+    oldest = ids.last()
+    sample_start = ids[COUNT_ESTIMATE_THRESHOLD - 1]
+    # плотность записей ленты среди последних id переносим на весь диапазон
+    density = COUNT_ESTIMATE_THRESHOLD / (newest - sample_start + 1)
+    return max(capped, round(density * (newest - oldest + 1)))
+
+
+def post_feeds(author_id, group_id):
+    feeds = [INDEX_FEED, author_feed(author_id)]
+    if group_id is not None:
+        feeds.append(group_feed(group_id))
+    return feeds
+
+
+def forget(feeds):
+    """Сбрасывает счётчики лент после записей в обход сигналов."""
+    cache.delete_many([cache_key(feed) for feed in feeds])
+
+
+def shift(feeds, delta):
+    """Сдвигает закешированные счётчики; отсутствующие посчитаются позже."""
+    for feed in feeds:
+        try:
+            cache.incr(cache_key(feed), delta)
+        except ValueError:
+            pass
@@ -1,4 +1,6 @@
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm, Textarea
+from . import images
 from .models import Post, Comment
 
 
@@ -7,6 +9,19 @@ class PostForm(ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        """Новая картинка уменьшается и очищается от метаданных."""
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return images.normalize(image)
+        return image
+
+    def save(self, commit=True):
+        if 'image' in self.changed_data:
+            # варианты прежней картинки новой не подходят
+            self.instance.image_variants = ''
+        return super().save(commit)
+
 
 class CommentForm(ModelForm):
     class Meta:
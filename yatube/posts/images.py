@@ -0,0 +1,145 @@
+"""Приведение загруженных картинок постов к разумному виду.
+
+Фотографии с камер весят мегабайты, несут EXIF (в том числе координаты)
+и потом раз за разом декодируются при нарезке миниатюр. Здесь картинка
+при загрузке уменьшается до ``MAX_SIDE`` по большей стороне, теряет
+метаданные и перекодируется так, чтобы уложиться в ``MAX_BYTES``.
+
+Картинка читается с диска (загрузки пишутся во временные файлы, см.
+``FILE_UPLOAD_HANDLERS``), результат тоже пишется во временный файл:
+целиком в памяти не держится ни то, ни другое. Слишком большие по числу
+точек картинки отвергаются по заголовку, до декодирования.
+"""
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image, ImageOps
+
+from core import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SIDE = getattr(settings, 'POSTS_IMAGE_MAX_SIDE', 2048)
+MAX_PIXELS = getattr(settings, 'POSTS_IMAGE_MAX_PIXELS', 40_000_000)
+MAX_BYTES = getattr(settings, 'POSTS_IMAGE_MAX_BYTES', 2 * 1024 * 1024)
+# качество JPEG/WebP: пробуем по убыванию, пока не уложимся в MAX_BYTES
+QUALITIES = (85, 75, 65)
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+METADATA = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop')
+# во что перекодировать: остальное сохраняется как JPEG
+FORMATS = {
+    'JPEG': ('JPEG', 'image/jpeg', '.jpg'),
+    'PNG': ('PNG', 'image/png', '.png'),
+    'GIF': ('GIF', 'image/gif', '.gif'),
+    'WEBP': ('WEBP', 'image/webp', '.webp'),
+}
+
+images_normalized = metrics.Counter(
+    'yatube_images_normalized_total', 'Перекодированные загрузки картинок'
+)
+image_bytes_saved = metrics.Counter(
+    'yatube_image_bytes_saved_total', 'Сэкономленные на загрузках байты'
+)
+
+
+def normalize(upload):
+    """Нормализованная копия загруженной картинки ``upload``.
+
+    Возвращает новый временный файл; ``ValidationError``, если картинка
+    слишком велика.
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        source = upload.temporary_file_path()
+    else:
+        source = upload
+        upload.seek(0)
+    with Image.open(source) as image:
+        width, height = image.size
+        if width * height > MAX_PIXELS:
+            raise ValidationError(
+                'Слишком большая картинка: не больше %(limit)d Мпикс.',
+                code='too_many_pixels',
+                params={'limit': MAX_PIXELS // 1_000_000},
+            )
+        if getattr(image, 'is_animated', False):
+            # кадры анимации не перекодируем, только проверяем размеры
+            return check_animation(upload, image)
+        image_format, content_type, extension = FORMATS.get(
+            image.format, FORMATS['JPEG']
+        )
+        untouched = (
+            max(width, height) <= MAX_SIDE
+            and image.format in FORMATS
+            and not any(key in image.info for key in METADATA)
+        )
+        # JPEG умеет декодироваться сразу в уменьшенном масштабе
+        image.draft('RGB', (MAX_SIDE, MAX_SIDE))
+        try:
+            image = ImageOps.exif_transpose(image)
+        except OSError:
+            # заголовок прошёл проверку ImageField, а данные битые
+            raise ValidationError(
+                'Картинка повреждена.', code='invalid_image'
+            )
+        image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        name = os.path.splitext(upload.name)[0] + extension
+        # безымянный временный файл: хранилище скопирует его по частям,
+        # а система удалит при закрытии
+        result = UploadedFile(
+            tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR),
+            name, content_type, 0
+        )
+        encode(image, result, image_format)
+    if untouched and result.size >= upload.size:
+        # перекодирование ничего не дало: оставляем оригинал
+        result.close()
+        upload.seek(0)
+        return upload
+    saved = upload.size - result.size
+    images_normalized.inc()
+    image_bytes_saved.inc(value=saved)
+    logger.info('Картинка %s: %d -> %d байт', name, upload.size, result.size)
+    return result
+
+
+def encode(image, result, image_format):
+    """Пишет ``image`` в ``result`` без метаданных, не больше MAX_BYTES."""
+    options = {'optimize': True}
+    if image.info.get('icc_profile'):
+        # цветовой профиль — не метаданные: без него поедут цвета
+        options['icc_profile'] = image.info['icc_profile']
+    qualities = QUALITIES if image_format in LOSSY_FORMATS else (None,)
+    for quality in qualities:
+        if quality is not None:
+            options['quality'] = quality
+        result.seek(0)
+        result.truncate()
+        image.save(result, image_format, **options)
+        result.size = result.tell()
+        if result.size <= MAX_BYTES:
+            break
+    else:
+        raise ValidationError(
+            'Картинка не сжимается до %(limit)d КБ.',
+            code='too_large',
+            params={'limit': MAX_BYTES // 1024},
+        )
+    result.seek(0)
+
+
+def check_animation(upload, image):
+    if max(image.size) > MAX_SIDE:
+        raise ValidationError(
+            'Анимация больше %(limit)d точек по стороне.',
+            code='too_large_animation',
+            params={'limit': MAX_SIDE},
+        )
+    upload.seek(0)
+    return upload
@@ -0,0 +1,371 @@
+"""Нагрузочный замер страниц постов.
+
+Команда поднимает отдельную временную базу (как при тестах), засевает её
+воспроизводимым набором данных — авторы, группы, посты с картинками,
+комментарии, подписки со степенным распределением популярности — и по
+очереди нагружает каждое представление из ``SCENARIOS`` в несколько
+потоков. Для каждого считаются задержки p50/p95/p99, пропускная
+способность и число запросов к базе на запрос. Итог можно сохранить
+в JSON (``--output``) и сравнить с прошлым (``--baseline``): ухудшение
+больше ``--tolerance`` считается регрессией, и команда падает.
+"""
+import io
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from posts import thumbnails, timeline
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+WORDS = ('пост', 'котик', 'новости', 'погода', 'город', 'книга', 'кофе',
+         'утро', 'поезд', 'море', 'код', 'релиз', 'музыка', 'вечер')
+IMAGE_COLORS = ('#c33', '#3c3', '#33c', '#cc3', '#3cc', '#c3c')
+NO_GROUP_SHARE = 0.3
+# показатель степенного закона популярности авторов и постов
+ZIPF_EXPONENT = 1.1
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    """Накопленные веса для ``rng.choices(..., cum_weights=...)``."""
+    return list(accumulate(1 / (rank + 1) ** exponent
+                           for rank in range(count)))
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def seed(options, rng):
+    """Засевает базу; возвращает то, из чего сценарии строят запросы."""
+    User.objects.bulk_create(
+        User(username=f'bench{number}', password='!')
+        for number in range(options['authors'])
+    )
+    users = list(User.objects.filter(username__startswith='bench'))
+    Group.objects.bulk_create(
+        Group(title=f'Группа {number}', slug=f'bench-{number}',
+              description=words(rng, 10))
+        for number in range(options['groups'])
+    )
+    groups = list(Group.objects.all())
+    storage = Post._meta.get_field('image').storage
+    images = []
+    for color in IMAGE_COLORS if options['images'] else ():
+        content = io.BytesIO()
+        Image.new('RGB', (960, 640), color).save(content, 'JPEG')
+        images.append(storage.save('posts/bench.jpg', ContentFile(
+            content.getvalue()
+        )))
+    author_weights = zipf_weights(len(users))
+    Post.objects.bulk_create(
+        (Post(
+            text=words(rng, rng.randint(5, 60)),
+            author=rng.choices(users, cum_weights=author_weights)[0],
+            group=(None if rng.random() < NO_GROUP_SHARE
+                   else rng.choice(groups)),
+            image=(rng.choice(images) if rng.random() < options['images']
+                   else ''),
+        ) for _ in range(options['posts'])),
+        batch_size=500
+    )
+    for name in images:
+        thumbnails.generate_in_background(name)
+    posts = list(Post.objects.order_by('pk'))
+    follows = set()
+    for user in users:
+        wanted = min(int(rng.paretovariate(1.5)), len(users) - 1)
+        for author in rng.choices(users, cum_weights=author_weights, k=wanted):
+            if author != user:
+                follows.add((user.pk, author.pk))
+    Follow.objects.bulk_create(
+        (Follow(user_id=user, author_id=author) for user, author in follows),
+        batch_size=500
+    )
+    post_weights = zipf_weights(len(posts))
+    shuffled = rng.sample(posts, len(posts))
+    Comment.objects.bulk_create(
+        (Comment(
+            post=rng.choices(shuffled, cum_weights=post_weights)[0],
+            author=rng.choice(users),
+            text=words(rng, rng.randint(3, 20)),
+        ) for _ in range(options['comments'])),
+        batch_size=500
+    )
+    # даты — по возрастанию id, за последний год
+    now = timezone.now()
+    step = timedelta(days=365) / max(len(posts), 1)
+    for number, post in enumerate(posts):
+        post.created = now - step * (len(posts) - number)
+    Post.objects.bulk_update(posts, ['created'], batch_size=500)
+    AuthorStats.objects.rebuild()
+    if timeline.enabled():
+        for follow in Follow.objects.select_related('user', 'author'):
+            timeline.backfill(follow.user, follow.author)
+    return {
+        'users': [user.username for user in users],
+        'groups': [group.slug for group in groups],
+        'posts': [post.pk for post in posts],
+        'post_weights': post_weights,
+        'shuffled': [post.pk for post in shuffled],
+    }
+
+
+def popular_post(rng, data):
+    """Пост, выбранный с учётом популярности: одни читают чаще других."""
+    return rng.choices(data['shuffled'], cum_weights=data['post_weights'])[0]
+
+
+def read(name, kwargs=lambda rng, data: {}):
+    """Сценарий чтения: GET страницы, аргументы которой выбирает kwargs."""
+    return lambda rng, data: (
+        'get', reverse(name, kwargs=kwargs(rng, data)), None
+    )
+
+
+SCENARIOS = {
+    'index': read('posts:index'),
+    'group_posts': read('posts:group_list', kwargs=lambda rng, data: {
+        'slug': rng.choice(data['groups'])
+    }),
+    'profile': read('posts:profile', kwargs=lambda rng, data: {
+        'username': rng.choice(data['users'])
+    }),
+    'post_detail': read('posts:post_detail', kwargs=lambda rng, data: {
+        'post_id': popular_post(rng, data)
+    }),
+    'follow_index': read('posts:follow_index'),
+    'post_create': lambda rng, data: (
+        'post', reverse('posts:post_create'), {'text': words(rng, 20)}
+    ),
+    'add_comment': lambda rng, data: (
+        'post',
+        reverse('posts:add_comment', kwargs={
+            'post_id': popular_post(rng, data)
+        }),
+        {'text': words(rng, 8)}
+    ),
+}
+# сценарии, которым нужен вошедший пользователь
+LOGIN_REQUIRED = ('follow_index', 'post_create', 'add_comment')
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу из отсортированного ``values``."""
+    if not values:
+        return None
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for latency, _, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, ok in samples if not ok),
+        'rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': round(
+            sum(queries for _, queries, _ in samples) / len(samples), 2
+        ),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Регрессии ``current`` относительно ``baseline`` списком строк."""
+    found = []
+    for view, now in current.items():
+        before = baseline.get(view)
+        if before is None:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(
+                f'{view}: p95 {before["p95_ms"]} -> {now["p95_ms"]} мс'
+            )
+        if now['rps'] < before['rps'] * (1 - tolerance):
+            found.append(f'{view}: {before["rps"]} -> {now["rps"]} запр./с')
+        if now['queries'] > before['queries'] + 0.5:
+            found.append(
+                f'{view}: запросов к базе {before["queries"]} -> '
+                f'{now["queries"]}'
+            )
+        if now['errors'] > before['errors']:
+            found.append(f'{view}: ошибок {before["errors"]} -> '
+                         f'{now["errors"]}')
+    return found
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный замер страниц постов на временной базе '
+            'с воспроизводимым набором данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', nargs='+', choices=list(SCENARIOS),
+                            default=list(SCENARIOS),
+                            help='Какие представления нагружать')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Одновременных клиентов')
+        parser.add_argument('--seconds', type=float, default=5,
+                            help='Длительность замера одного представления')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Неучитываемых запросов перед замером')
+        parser.add_argument('--authors', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--images', type=float, default=0.2,
+                            help='Доля постов с картинкой')
+        parser.add_argument('--anonymous', type=float, default=0.5,
+                            help='Доля анонимных клиентов на чтении')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора данных и запросов')
+        parser.add_argument('--output', help='Куда записать итог в JSON')
+        parser.add_argument('--baseline',
+                            help='JSON прошлого замера для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимое ухудшение, доля')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['views']
+        with tempfile.TemporaryDirectory() as directory:
+            results = self.isolated(directory, options)
+        for view, result in results.items():
+            self.stdout.write(
+                f'{view:<13} {result["rps"]:>8} запр./с  '
+                f'p50 {result["p50_ms"]:>7} мс  '
+                f'p95 {result["p95_ms"]:>7} мс  '
+                f'p99 {result["p99_ms"]:>7} мс  '
+                f'запросов {result["queries"]:>5}  '
+                f'ошибок {result["errors"]}'
+            )
+        if options['output']:
+            report = {
+                'meta': {
+                    'created': timezone.now().isoformat(),
+                    'django': django.get_version(),
+                    'python': platform.python_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                    'options': {
+                        key: options[key] for key in (
+                            'views', 'threads', 'seconds', 'warmup',
+                            'authors', 'groups', 'posts', 'comments',
+                            'images', 'anonymous', 'seed'
+                        )
+                    },
+                },
+                'views': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError(
+                    'Регрессии:\n' + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def isolated(self, directory, options):
+        """Замер на временной базе, кеше и хранилище картинок."""
+        connection = connections['default']
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            directory, 'benchmark.sqlite3'
+        )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        cache = {
+            'BACKEND': 'core.cache.SQLiteCache',
+            'LOCATION': os.path.join(directory, 'cache.sqlite3'),
+        }
+        try:
+            # DEBUG выключен, как в работе: без debug_toolbar и без
+            # журнала запросов в connection.queries
+            with override_settings(
+                DEBUG=False,
+                CACHES={'default': settings.CACHES['default'],
+                        'store': cache},
+                MEDIA_ROOT=os.path.join(directory, 'media'),
+                DATABASE_REPLICAS=[],
+            ):
+                rng = random.Random(options['seed'])
+                self.stdout.write('Засеваю базу...')
+                data = seed(options, rng)
+                return {
+                    view: self.drive(view, data, options)
+                    for view in options['views']
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def drive(self, view, data, options):
+        scenario = SCENARIOS[view]
+        samples = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+        started = []
+
+        def work(number):
+            rng = random.Random(f'{options["seed"]}:{view}:{number}')
+            client = Client()
+            anonymous = (view not in LOGIN_REQUIRED
+                         and rng.random() < options['anonymous'])
+            if not anonymous:
+                client.force_login(
+                    User.objects.get(username=rng.choice(data['users']))
+                )
+            for _ in range(options['warmup']):
+                self.request(client, scenario, rng, data)
+            barrier.wait()
+            with lock:
+                if not started:
+                    started.append(time.perf_counter())
+            deadline = time.monotonic() + options['seconds']
+            done = []
+            while time.monotonic() < deadline:
+                done.append(self.request(client, scenario, rng, data))
+            with lock:
+                samples.extend(done)
+            connections.close_all()
+
+        threads = [
+            threading.Thread(target=work, args=(number,))
+            for number in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(samples, time.perf_counter() - started[0])
+
+    @staticmethod
+    def request(client, scenario, rng, data):
+        """Один запрос: (задержка, запросов к базе, успешен ли)."""
+        method, path, payload = scenario(rng, data)
+        started = time.perf_counter()
+        response = getattr(client, method)(path, payload)
+        latency = time.perf_counter() - started
+        queries = len(getattr(response, 'query_log', ()))
+        return latency, queries, response.status_code < 400
@@ -0,0 +1,55 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import Post
+from posts.thumbnails import generate
+
+
+def generate_safely(name):
+    try:
+        return name, generate(name), None
+    except Exception as error:
+        return name, 0, repr(error)
+
+
+class Command(BaseCommand):
+    help = 'Нарезает миниатюры для всех картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов (по умолчанию — по числу ядер)'
+        )
+
+    def handle(self, *args, **options):
+        names = list(
+            Post.objects.exclude(image='').order_by()
+            .values_list('image', flat=True).distinct()
+        )
+        # дочерние процессы не должны делить соединение с родителем
+        connections.close_all()
+        started = time.monotonic()
+        done = failed = 0
+        # при spawn и forkserver процессы начинают с чистого интерпретатора:
+        # Django в них настраивается заново, до первой задачи
+        pool = ProcessPoolExecutor(
+            max_workers=options['workers'], initializer=django.setup
+        )
+        with pool:
+            futures = [pool.submit(generate_safely, name) for name in names]
+            for future in as_completed(futures):
+                name, count, error = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                else:
+                    done += count
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок: {len(names)}, миниатюр: {done}, ошибок: {failed}, '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,392 @@
+"""Загрузка групп, постов, комментариев и подписок из NDJSON или CSV.
+
+Каждая строка входа — одна запись. Её вид задаёт поле ``type``
+(``group``, ``post``, ``comment``, ``follow``) или опция ``--type``,
+так что выгрузку ``/api/v1/posts/export/`` можно загрузить с
+``--type post``. Поля записей:
+
+- group: slug, title, description;
+- post: text, author, group, created, image (имя файла в хранилище
+  или его URL из выгрузки), id;
+- comment: post (id поста), author, text, created, id;
+- follow: user, author.
+
+Авторы и группы указываются по username и slug и ищутся через словари
+в памяти: каждое имя запрашивается из базы один раз. Вход читается
+потоком, записи копятся пачками по ``--batch-size`` и пишутся
+``bulk_create``, каждая пачка в своей транзакции: группы раньше постов,
+посты раньше комментариев. Уже существующие подписки (ограничение
+``unique_author_user_following``), группы с занятым slug и записи
+с занятым id пропускаются: повторная загрузка не удваивает подписки,
+группы и записи с id. Посты и комментарии без id загружаются заново
+при каждом запуске.
+
+Сигналы при ``bulk_create`` не срабатывают, поэтому номера изменений,
+поисковый индекс, счётчики лент, кеш страниц и статистику авторов
+команда обновляет сама. При ``POSTS_FANOUT`` каждая пачка раскладывает
+свои посты во входящие подписчиков и пополняет входящие своих новых
+подписок.
+"""
+import csv
+import json
+import sys
+import time
+from urllib.parse import unquote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import caching, changes, counters, search, timeline
+from posts.models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+MODELS = {'group': Group, 'post': Post, 'comment': Comment, 'follow': Follow}
+REQUIRED = {
+    'group': ('slug',),
+    'post': ('text', 'author'),
+    'comment': ('post', 'author', 'text'),
+    'follow': ('user', 'author'),
+}
+INTEGER_FIELDS = {'post': ('id',), 'comment': ('id', 'post')}
+USER_FIELDS = {'post': ('author',), 'comment': ('author',),
+               'follow': ('user', 'author')}
+
+
+def read_records(stream, input_format):
+    """Номер строки и запись: словарь из CSV или строка NDJSON."""
+    if input_format == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), 2):
+            yield number, {
+                key: value for key, value in row.items() if value
+            }
+        return
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            yield number, line
+
+
+def parse_created(value):
+    if not value:
+        return timezone.now()
+    created = parse_datetime(value)
+    if created is None:
+        raise ValueError(f'неверная дата: {value}')
+    if timezone.is_naive(created):
+        created = timezone.make_aware(created)
+    return created
+
+
+def normalize(record, kind):
+    """Проверяет запись и приводит типы полей; ValueError для кривых."""
+    missing = [field for field in REQUIRED[kind] if not record.get(field)]
+    if missing:
+        raise ValueError(f'нет полей: {", ".join(missing)}')
+    for field in INTEGER_FIELDS.get(kind, ()):
+        if record.get(field) is not None:
+            record[field] = int(record[field])
+    if kind in ('post', 'comment'):
+        record['created'] = parse_created(record.get('created'))
+    return record
+
+
+def image_name(value):
+    """Имя файла в хранилище: выгрузка отдаёт картинку её URL."""
+    base_url = Post._meta.get_field('image').storage.base_url
+    path = urlsplit(value).path
+    if path.startswith(base_url):
+        return unquote(path[len(base_url):])
+    return value
+
+
+def lookup(mapping, queryset, field, names):
+    """Дополняет словарь ``mapping`` (имя → id) недостающими из базы."""
+    missing = set(names) - mapping.keys()
+    if missing:
+        mapping.update(
+            queryset.filter(**{f'{field}__in': missing})
+            .values_list(field, 'pk')
+        )
+
+
+def restore_created(model, numbers, created):
+    """Даты создания из входа у записей пачки с номерами ``numbers``.
+
+    ``bulk_create`` заменяет их текущим временем (``auto_now_add``),
+    поэтому они проставляются следом, ``bulk_update``. Пропущенные
+    дубликаты сохранили свои номера и не затрагиваются.
+    """
+    if not numbers:
+        return
+    by_number = dict(zip(numbers, created))
+    saved = list(model.objects.filter(
+        change_seq__range=(numbers[0], numbers[-1])
+    ).only('pk', 'change_seq'))
+    for instance in saved:
+        instance.created = by_number[instance.change_seq]
+    model.objects.bulk_update(saved, ['created'])
+
+
+class Importer:
+    """Пачка записей и словари авторов и групп одного импорта."""
+
+    def __init__(self, default_type=None, create_users=False, report=None):
+        self.default_type = default_type
+        self.create_users = create_users
+        self.report = report or (lambda number, reason: None)
+        self.authors = {}
+        self.groups = {}
+        self.pending = {kind: [] for kind in MODELS}
+        self.size = 0
+        self.skipped = 0
+        self.feeds = set()
+        self.scopes = set()
+
+    def add(self, number, record):
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            kind = record.get('type', self.default_type)
+            if kind not in MODELS:
+                raise ValueError(f'неизвестный type: {kind}')
+            self.pending[kind].append((number, normalize(record, kind)))
+            self.size += 1
+        except (ValueError, TypeError, AttributeError) as exc:
+            self.skip(number, exc)
+
+    def skip(self, number, reason):
+        self.skipped += 1
+        self.report(number, reason)
+
+    def flush(self):
+        """Пишет накопленную пачку одной транзакцией."""
+        with transaction.atomic():
+            self.save_groups()
+            self.resolve_authors()
+            self.save_posts()
+            self.save_comments()
+            self.save_follows()
+        self.pending = {kind: [] for kind in MODELS}
+        self.size = 0
+
+    def finish(self):
+        """Последняя пачка и то, что обычно делают сигналы."""
+        self.flush()
+        counters.forget(self.feeds)
+        if self.scopes:
+            caching.touch(*self.scopes)
+        AuthorStats.objects.rebuild()
+
+    def resolved(self, kind, references):
+        """Записи ``kind`` с id ссылок из ``references``; прочие — в отчёт."""
+        for number, record in self.pending[kind]:
+            ids = {}
+            for field, mapping in references.items():
+                value = record.get(field)
+                if value is not None and value not in mapping:
+                    self.skip(number, f'не найдено {field}: {value}')
+                    break
+                ids[field] = mapping.get(value)
+            else:
+                yield number, record, ids
+
+    def resolve_authors(self):
+        names = {
+            record[field]
+            for kind, fields in USER_FIELDS.items()
+            for _, record in self.pending[kind] for field in fields
+        }
+        lookup(self.authors, User.objects, 'username', names)
+        missing = names - self.authors.keys()
+        if missing and self.create_users:
+            User.objects.bulk_create(
+                (User(username=name, password='!') for name in missing),
+                ignore_conflicts=True
+            )
+            lookup(self.authors, User.objects, 'username', missing)
+
+    def save_groups(self):
+        records = [record for _, record in self.pending['group']]
+        numbers = changes.allocate_many(Group, len(records))
+        Group.objects.bulk_create(
+            (Group(
+                slug=record['slug'],
+                title=record.get('title', record['slug']),
+                description=record.get('description', ''),
+                change_seq=number,
+            ) for record, number in zip(records, numbers)),
+            ignore_conflicts=True
+        )
+
+    def save_posts(self):
+        lookup(self.groups, Group.objects, 'slug', (
+            record['group'] for _, record in self.pending['post']
+            if record.get('group')
+        ))
+        rows = list(self.resolved(
+            'post', {'author': self.authors, 'group': self.groups}
+        ))
+        numbers = changes.allocate_many(Post, len(rows))
+        posts = [
+            Post(
+                id=record.get('id'),
+                text=record['text'],
+                author_id=ids['author'],
+                group_id=ids['group'],
+                image=image_name(record.get('image', '')),
+                created=record['created'],
+                change_seq=number,
+            ) for (_, record, ids), number in zip(rows, numbers)
+        ]
+        if not posts:
+            return
+        Post.objects.bulk_create(posts, ignore_conflicts=True)
+        restore_created(
+            Post, numbers, [record['created'] for _, record, _ in rows]
+        )
+        # ``ignore_conflicts`` не возвращает id: новые посты — по номерам
+        saved = Post.objects.filter(
+            change_seq__range=(numbers[0], numbers[-1])
+        )
+        if search.available():
+            search.reindex_posts(saved)
+        if timeline.enabled():
+            timeline.fan_out_many(
+                list(saved.only('pk', 'author_id', 'created'))
+            )
+        for post in posts:
+            self.feeds.update(counters.post_feeds(post.author_id,
+                                                  post.group_id))
+        self.scopes.add(caching.INDEX_SCOPE)
+        self.scopes.update(caching.scopes_of(posts))
+
+    def save_comments(self):
+        post_ids = {record['post'] for _, record in self.pending['comment']}
+        existing = {
+            pk: pk for pk in
+            Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True)
+        }
+        rows = list(self.resolved(
+            'comment', {'author': self.authors, 'post': existing}
+        ))
+        numbers = changes.allocate_many(Comment, len(rows))
+        Comment.objects.bulk_create(
+            (Comment(
+                id=record.get('id'),
+                post_id=ids['post'],
+                author_id=ids['author'],
+                text=record['text'],
+                created=record['created'],
+                change_seq=number,
+            ) for (_, record, ids), number in zip(rows, numbers)),
+            ignore_conflicts=True
+        )
+        restore_created(
+            Comment, numbers, [record['created'] for _, record, _ in rows]
+        )
+        for _, _, ids in rows:
+            self.feeds.add(counters.comments_feed(ids['post']))
+            self.scopes.add(caching.post_scope(ids['post']))
+
+    def save_follows(self):
+        follows = []
+        for number, record, ids in self.resolved(
+                'follow', {'user': self.authors, 'author': self.authors}):
+            if ids['user'] == ids['author']:
+                self.skip(number, f'подписка на себя: {record["user"]}')
+                continue
+            follows.append(Follow(user_id=ids['user'],
+                                  author_id=ids['author']))
+        Follow.objects.bulk_create(follows, ignore_conflicts=True)
+        if timeline.enabled():
+            for follow in follows:
+                timeline.backfill(User(pk=follow.user_id),
+                                  User(pk=follow.author_id))
+        self.scopes.update(
+            caching.author_scope(follow.author_id) for follow in follows
+        )
+
+
+class Command(BaseCommand):
+    help = 'Загружает группы, посты, комментарии и подписки из NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source', help='Файл с записями; «-» — стандартный ввод'
+        )
+        parser.add_argument(
+            '--format', choices=('ndjson', 'csv'),
+            help='Формат входа (по умолчанию — по расширению файла)'
+        )
+        parser.add_argument(
+            '--type', choices=tuple(MODELS),
+            help='Вид записей, у которых нет поля type'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Записей в пачке и транзакции'
+        )
+        parser.add_argument(
+            '--create-users', action='store_true',
+            help='Заводить неизвестных авторов (без пароля)'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        source = options['source']
+        input_format = options['format'] or (
+            'csv' if source.endswith('.csv') else 'ndjson'
+        )
+        importer = Importer(
+            options['type'], options['create_users'], self.report
+        )
+        before = self.totals()
+        started = time.monotonic()
+        try:
+            stream = (sys.stdin if source == '-'
+                      else open(source, encoding='utf-8', newline=''))
+        except OSError as exc:
+            raise CommandError(exc)
+        rows = 0
+        with stream:
+            for rows, (number, record) in enumerate(
+                    read_records(stream, input_format), 1):
+                importer.add(number, record)
+                if importer.size >= options['batch_size']:
+                    importer.flush()
+                    self.progress(rows, started, options['verbosity'])
+            importer.finish()
+        self.summary(rows, importer.skipped, before, started)
+
+    def report(self, number, reason):
+        self.stderr.write(f'строка {number}: {reason}')
+
+    def progress(self, rows, started, verbosity):
+        if verbosity >= 2:
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Строк: {rows}, {rows / max(elapsed, 1e-6):.0f} строк/с'
+            )
+
+    @staticmethod
+    def totals():
+        return {
+            kind: model.objects.count() for kind, model in MODELS.items()
+        }
+
+    def summary(self, rows, skipped, before, started):
+        elapsed = time.monotonic() - started
+        added = {
+            kind: total - before[kind]
+            for kind, total in self.totals().items()
+        }
+        duplicates = rows - skipped - sum(added.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк: {rows}, добавлено: групп {added["group"]}, '
+            f'постов {added["post"]}, комментариев {added["comment"]}, '
+            f'подписок {added["follow"]}; дубликатов: {duplicates}, '
+            f'с ошибками: {skipped}; '
+            f'за {elapsed:.1f} с, {rows / max(elapsed, 1e-6):.0f} строк/с'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import AuthorStats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики авторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пачки при записи счётчиков'
+        )
+
+    def handle(self, *args, **options):
+        fixed = AuthorStats.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено записей статистики: {fixed}'
+        ))
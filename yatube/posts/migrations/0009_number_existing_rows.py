@@ -0,0 +1,41 @@
+from django.db import migrations
+from django.db.models import Max
+
+
+def number_existing_rows(apps, schema_editor):
+    """Номера изменений строкам, созданным до журнала изменений.
+
+    Без них ``changes.since(0)`` не отдаёт старые объекты, и новый
+    потребитель не может загрузить всё с нуля.
+    """
+    Change = apps.get_model('posts', 'Change')
+    for name in ('Group', 'Post', 'Comment'):
+        model = apps.get_model('posts', name)
+        ids = list(
+            model.objects.filter(change_seq=0).order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        if not ids:
+            continue
+        Change.objects.bulk_create(
+            (Change(model=name.lower()) for _ in ids), batch_size=500
+        )
+        last = Change.objects.aggregate(last=Max('pk'))['last']
+        model.objects.bulk_update(
+            [model(pk=pk, change_seq=number)
+             for number, pk in enumerate(ids, last - len(ids) + 1)],
+            ['change_seq'], batch_size=500
+        )
+    # журналу нужны только удаления
+    Change.objects.filter(deleted=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_change_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_existing_rows, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth import get_user_model
 
-from core.models import CreatedModel
+from core.models import CreatedModel, ModifiedModel
+from core.storage import ContentAddressedStorage
 
 
 User = get_user_model()
 
 
-class Group(models.Model):
+class Group(ModifiedModel):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
@@ -16,7 +18,7 @@ class Group(models.Model):
         return self.title
 
 
-class Post(CreatedModel):
+class Post(CreatedModel, ModifiedModel):
     text = models.TextField(
         'Текст поста',
         help_text='Введите текст поста'
@@ -38,8 +40,15 @@ class Post(CreatedModel):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    image_variants = models.TextField(
+        'Варианты картинки',
+        blank=True,
+        editable=False,
+        help_text='JSON-манифест нарезанных вариантов картинки'
+    )
 
     def __str__(self):
         return self.text[:15]
@@ -48,9 +57,16 @@ class Post(CreatedModel):
         ordering = ['-created']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # ленты группы и автора: фильтр и сортировка по одному индексу
+        indexes = [
+            models.Index(fields=['group', 'created'],
+                         name='post_group_created'),
+            models.Index(fields=['author', 'created'],
+                         name='post_author_created'),
+        ]
 
 
-class Comment(CreatedModel):
+class Comment(CreatedModel, ModifiedModel):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
@@ -68,6 +84,10 @@ class Comment(CreatedModel):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created'),
+        ]
 
 
 class Follow(models.Model):
@@ -88,3 +108,150 @@ class Follow(models.Model):
                 fields=['user', 'author'], name='unique_author_user_following'
             )
         ]
+        # подписчики автора без обращения к таблице: для рассылки в ленты;
+        # подписки пользователя покрывает уникальный индекс (user, author)
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user'),
+        ]
+
+
+class AuthorStatsManager(models.Manager):
+    use_in_migrations = True
+
+    def shift(self, author_id, **deltas):
+        """Атомарно сдвигает счётчики автора: ``shift(pk, posts_count=1)``.
+
+        Разошедшийся с данными счётчик не уходит ниже нуля: положительное
+        поле отвергло бы такое обновление ``IntegrityError``. Автору без
+        записи (созданному ``bulk_create`` и т. п.) она заводится при первом
+        увеличении; уменьшать у него нечего.
+        """
+        shifted = {
+            field: Greatest(models.F(field) + delta, 0)
+            for field, delta in deltas.items()
+        }
+        if self.filter(author_id=author_id).update(**shifted):
+            return
+        if all(delta <= 0 for delta in deltas.values()):
+            return
+        _, created = self.get_or_create(author_id=author_id, defaults={
+            field: max(delta, 0) for field, delta in deltas.items()
+        })
+        if not created:
+            # запись успел завести параллельный запрос
+            self.filter(author_id=author_id).update(**shifted)
+
+    def rebuild(self, batch_size=1000):
+        """Пересчитывает счётчики всех авторов.
+
+        Возвращает число созданных или исправленных записей.
+        """
+        apps = self.model._meta.apps
+        user_model = self.model._meta.get_field('author').related_model
+        sources = {
+            'posts_count': (apps.get_model('posts', 'Post'), 'author'),
+            'followers_count': (apps.get_model('posts', 'Follow'), 'author'),
+            'following_count': (apps.get_model('posts', 'Follow'), 'user'),
+            'comments_count': (apps.get_model('posts', 'Comment'), 'author'),
+        }
+        annotations = {
+            field: Coalesce(models.Subquery(
+                model.objects.filter(**{lookup: models.OuterRef('pk')})
+                .order_by().values(lookup)
+                .annotate(total=models.Count('pk')).values('total')
+            ), 0)
+            for field, (model, lookup) in sources.items()
+        }
+        existing = self.in_bulk()
+        missing, drifted = [], []
+        actual = user_model.objects.annotate(**annotations).values_list(
+            'pk', *sources
+        )
+        for pk, *counts in actual.iterator():
+            row = self.model(pk, *counts)
+            if pk not in existing:
+                missing.append(row)
+            elif any(getattr(existing[pk], field) != getattr(row, field)
+                     for field in sources):
+                drifted.append(row)
+        with transaction.atomic(using=self.db):
+            self.bulk_create(missing, batch_size=batch_size)
+            self.bulk_update(drifted, list(sources), batch_size=batch_size)
+        return len(missing) + len(drifted)
+
+
+class AuthorStats(models.Model):
+    """Денормализованные счётчики автора.
+
+    Обновляются сигналами сохранения и удаления постов, подписок и
+    комментариев; при расхождении пересчитываются командой
+    ``rebuild_author_stats``.
+    """
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Автор'
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    comments_count = models.PositiveIntegerField('Комментариев', default=0)
+
+    objects = AuthorStatsManager()
+
+    def __str__(self):
+        return f'Статистика {self.author}'
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+
+class TimelineEntry(models.Model):
+    """Пост во «входящих» подписчика (fan-out-on-write ленты подписок)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    created = models.DateTimeField('Дата создания поста')
+
+    class Meta:
+        ordering = ['-created']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_timeline_user_post'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created'], name='timeline_user_created'
+            )
+        ]
+
+
+class Change(models.Model):
+    """Журнал изменений групп, постов и комментариев.
+
+    Номер записи — номер изменения: его получает ``change_seq``
+    сохраняемого объекта. Для удалённых объектов запись остаётся
+    единственным следом. Номера выдаются по возрастанию и не повторяются
+    (AUTOINCREMENT в SQLite).
+    """
+    model = models.CharField('Модель', max_length=20)
+    object_id = models.IntegerField('Объект', null=True)
+    deleted = models.BooleanField('Удалён', default=False)
+
+    class Meta:
+        ordering = ['pk']
+        indexes = [
+            models.Index(fields=['deleted', 'id'], name='change_deleted_id')
+        ]
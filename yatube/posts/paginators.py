@@ -0,0 +1,129 @@
+import base64
+import binascii
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from .counters import feed_count
+
+
+AFTER = 'a'
+BEFORE = 'b'
+
+
+class CursorPage(Page):
+    """Страница, выбранная по курсору. Номера страницы у неё нет."""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<CursorPage of %s objects>' % len(self)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+
+class FeedPaginator(Paginator):
+    """Пагинатор ленты постов с кешированным счётчиком записей.
+
+    Общее число берётся из ``counters`` по ключам лент ``feeds`` и может
+    быть приблизительным, поэтому срез страницы им не ограничивается.
+    """
+
+    def __init__(self, object_list, per_page, feeds=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.feeds = feeds
+
+    @cached_property
+    def count(self):
+        if self.feeds is None:
+            return super().count
+        return feed_count(self.feeds)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        return self._get_page(self.object_list[bottom:top], number, self)
+
+
+class CursorPaginator(FeedPaginator):
+    """Keyset-пагинатор по паре (created, id).
+
+    Первая страница и ссылки вида ``?page=N`` обслуживаются как обычно,
+    а следующие страницы выбираются по курсору условием
+    ``WHERE (created, id) < (...)`` вместо OFFSET, поэтому их стоимость
+    не зависит от глубины. Годятся и строки ``.values()``, если в них
+    есть ``created`` и ``id``.
+    """
+    ordering = ('-created', '-pk')
+
+    def __init__(self, object_list, per_page, **kwargs):
+        super().__init__(object_list.order_by(*self.ordering), per_page,
+                         **kwargs)
+
+    def get_page(self, number=None, cursor=None):
+        position = self.decode_cursor(cursor)
+        if position is None:
+            page = super().get_page(number)
+        else:
+            page = self.cursor_page(*position)
+        page.next_cursor = None
+        page.previous_cursor = None
+        if page.has_next() and len(page):
+            page.next_cursor = self.encode_cursor(page[-1], AFTER)
+        if page.has_previous() and len(page):
+            page.previous_cursor = self.encode_cursor(page[0], BEFORE)
+        return page
+
+    def cursor_page(self, direction, created, pk):
+        if direction == AFTER:
+            queryset = self.object_list.filter(
+                Q(created__lt=created) | Q(created=created, pk__lt=pk)
+            )
+        else:
+            queryset = self.object_list.filter(
+                Q(created__gt=created) | Q(created=created, pk__gt=pk)
+            ).reverse()
+        objects = list(queryset[:self.per_page + 1])
+        more = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if direction == AFTER:
+            return CursorPage(objects, self, has_next=more, has_previous=True)
+        objects.reverse()
+        return CursorPage(objects, self, has_next=True, has_previous=more)
+
+    @staticmethod
+    def encode_cursor(obj, direction):
+        if isinstance(obj, dict):
+            created, pk = obj['created'], obj['id']
+        else:
+            created, pk = obj.created, obj.pk
+        value = f'{direction}{created.isoformat()}|{pk}'
+        token = base64.urlsafe_b64encode(value.encode())
+        return token.decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Возвращает (direction, created, pk) или None для кривого курсора."""
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            value = base64.urlsafe_b64decode(cursor + padding).decode()
+            direction, value = value[0], value[1:]
+            created, pk = value.rsplit('|', 1)
+            created, pk = parse_datetime(created), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError, IndexError):
+            return None
+        if direction not in (AFTER, BEFORE) or created is None:
+            return None
+        return direction, created, pk
@@ -0,0 +1,145 @@
+"""Полнотекстовый поиск по тексту постов.
+
+На SQLite используется индекс FTS5 ``posts_post_search``: его строки
+имеют тот же rowid, что и посты, а поддерживают его сигналы сохранения
+и удаления постов. На других СУБД поиск сводится к ``icontains``.
+
+Выдача ограничена ``MAX_RESULTS`` постами. Пока совпадений не больше,
+они упорядочены по релевантности (bm25); у слишком общих запросов
+ранжирование всех совпадений стоило бы дороже, чем имеет смысл, и они
+показываются от новых к старым.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import cached_property
+
+from .models import Post
+
+
+TABLE = 'posts_post_search'
+MAX_RESULTS = getattr(settings, 'POSTS_SEARCH_MAX_RESULTS', 10000)
+WORD_RE = re.compile(r'\w+')
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(text):
+    """Запрос FTS5 из пользовательского ввода: все слова.
+
+    Последнее слово ищется по префиксу — его, возможно, ещё дописывают.
+    Каждое слово берётся в кавычки, так что операторы FTS5 в запросе
+    не срабатывают.
+    """
+    terms = [f'"{word}"' for word in WORD_RE.findall(text.lower())]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def index_post(post):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text]
+        )
+
+
+def reindex_posts(queryset):
+    """Индексирует посты ``queryset`` разом — после записи в обход сигналов."""
+    ids_sql, ids_params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {TABLE} WHERE rowid IN ({ids_sql})', ids_params
+        )
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) '
+            f'SELECT id, text FROM {Post._meta.db_table} '
+            f'WHERE id IN ({ids_sql})',
+            ids_params
+        )
+
+
+def unindex_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+
+
+def filter_matching(queryset, text):
+    """Посты ``queryset``, подходящие под запрос, — подзапросом к индексу.
+
+    Не ``pk__in=RawSQL(...)``: RawSQL берёт SQL в свои скобки, и SQLite
+    читает ``IN ((SELECT ...))`` как скалярный подзапрос с одной строкой.
+    """
+    pk = '{}.{}'.format(
+        connection.ops.quote_name(queryset.model._meta.db_table),
+        connection.ops.quote_name(queryset.model._meta.pk.column)
+    )
+    return queryset.extra(
+        where=[f'{pk} IN (SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s)'],
+        params=[fts_query(text)]
+    )
+
+
+class SearchResults:
+    """Посты, найденные по запросу, от самых релевантных (bm25).
+
+    Отдаёт ``count()`` и срезы, поэтому подходит для ``Paginator``:
+    страница выбирается из индекса по LIMIT/OFFSET, а посты страницы
+    догружаются одним запросом.
+    """
+
+    def __init__(self, text, queryset=None):
+        self.text = text
+        self.query = fts_query(text)
+        self.queryset = queryset if queryset is not None else (
+            Post.objects.select_related('author', 'group')
+        )
+
+    @cached_property
+    def total(self):
+        if not self.query:
+            return 0
+        if not available():
+            queryset = self.queryset.filter(text__icontains=self.text)
+            return queryset[:MAX_RESULTS].count()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM ('
+                f' SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s'
+                f' LIMIT %s)',
+                [self.query, MAX_RESULTS]
+            )
+            return cursor.fetchone()[0]
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if not self.query:
+            return []
+        if not available():
+            return list(
+                self.queryset.filter(text__icontains=self.text)[index]
+            )
+        start = index.start or 0
+        stop = min(index.stop, MAX_RESULTS)
+        order = 'rank' if self.total < MAX_RESULTS else 'rowid DESC'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s '
+                f'ORDER BY {order} LIMIT %s OFFSET %s',
+                [self.query, max(stop - start, 0), start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = self.queryset.in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
@@ -0,0 +1,171 @@
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from . import caching, changes, counters, search, thumbnails
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_post(sender, instance, **kwargs):
+    """Запоминает прежние группу и картинку редактируемого поста."""
+    old = None
+    if instance.pk is not None:
+        old = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id', 'image', 'image_variants'
+        ).first()
+    instance._old_group_id, instance._old_image, instance._old_variants = (
+        old or (None, '', '')
+    )
+
+
+@receiver(pre_save, sender=Group)
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def number_change(sender, instance, **kwargs):
+    instance.change_seq = changes.allocate(sender, instance.pk)
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def record_deletion(sender, instance, **kwargs):
+    changes.allocate(sender, instance.pk, deleted=True)
+
+
+@receiver(pre_delete, sender=Group)
+def number_ungrouped_posts(sender, instance, **kwargs):
+    """Посты удаляемой группы теряют её в обход ``save()`` (SET_NULL)."""
+    changes.update(Post.objects.filter(group=instance))
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        counters.shift(
+            counters.post_feeds(instance.author_id, instance.group_id), 1
+        )
+    elif instance._old_group_id != instance.group_id:
+        if instance._old_group_id is not None:
+            counters.shift([counters.group_feed(instance._old_group_id)], -1)
+        if instance.group_id is not None:
+            counters.shift([counters.group_feed(instance.group_id)], 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.shift(
+        counters.post_feeds(instance.author_id, instance.group_id), -1
+    )
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.shift([counters.comments_feed(instance.post_id)], 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.shift([counters.comments_feed(instance.post_id)], -1)
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, **kwargs):
+    # и для loaddata (raw): иначе у загруженных авторов нет счётчиков
+    if created:
+        AuthorStats.objects.get_or_create(author=instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def count_author_content(sender, instance, created, **kwargs):
+    if created:
+        field = 'posts_count' if sender is Post else 'comments_count'
+        AuthorStats.objects.shift(instance.author_id, **{field: 1})
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def uncount_author_content(sender, instance, **kwargs):
+    field = 'posts_count' if sender is Post else 'comments_count'
+    AuthorStats.objects.shift(instance.author_id, **{field: -1})
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.shift(instance.author_id, followers_count=1)
+        AuthorStats.objects.shift(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    AuthorStats.objects.shift(instance.author_id, followers_count=-1)
+    AuthorStats.objects.shift(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def forget_post_card(sender, instance, **kwargs):
+    caching.forget_card(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def touch_post_pages(sender, instance, **kwargs):
+    scopes = [
+        caching.INDEX_SCOPE,
+        caching.post_scope(instance.pk),
+        *caching.scopes_of([instance]),
+    ]
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if old_group_id is not None:
+        scopes.append(caching.group_scope(old_group_id))
+    caching.touch(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_comment_pages(sender, instance, **kwargs):
+    caching.touch(caching.post_scope(instance.post_id))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def touch_group_pages(sender, instance, **kwargs):
+    caching.touch(caching.group_scope(instance.pk))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+@receiver(post_save, sender=User)
+def touch_author_pages(sender, instance, **kwargs):
+    author_id = instance.pk if sender is User else instance.author_id
+    caching.touch(caching.author_scope(author_id))
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, raw=False, **kwargs):
+    if search.available() and not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    if search.available():
+        search.unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, created, **kwargs):
+    old_image = getattr(instance, '_old_image', '')
+    if not created and old_image and old_image != instance.image.name:
+        thumbnails.release(old_image, instance._old_variants)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        thumbnails.release(instance.image.name, instance.image_variants)
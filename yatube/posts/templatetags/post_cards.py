@@ -0,0 +1,18 @@
+from django import template
+
+from posts import thumbnails
+from posts.caching import render_cards
+
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Кешированные карточки постов; на странице группы без ссылки на неё."""
+    return render_cards(posts, hide_group_link=bool(context.get('title')))
+
+
+@register.filter
+def image_sources(post):
+    return thumbnails.image_sources(post)
@@ -0,0 +1,96 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+
+from .. import api
+from ..models import Follow, Post
+
+from shortcuts import url, post, group, User
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.author = User.objects.create_user('author')
+        cls.group = group('slug')
+        [post(cls.author, cls.group) for _ in range(5)]
+        [post(cls.user) for _ in range(2)]
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        self.client = Client()
+        self.auth = Client()
+        self.auth.force_login(self.user)
+        cache.clear()
+
+    def test_feed_pages_follow_cursor(self):
+        expected = list(
+            Post.objects.order_by('-created', '-pk').values_list('pk',
+                                                                 flat=True)
+        )
+        walked, cursor = [], ''
+        with mock.patch.object(api, 'PER_PAGE', 3):
+            while True:
+                data = self.client.get(
+                    url('api:index'), {'cursor': cursor}
+                ).json()
+                walked += [item['id'] for item in data['results']]
+                cursor = data['next']
+                if not cursor:
+                    break
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(walked, expected)
+
+    def test_fields_are_selected(self):
+        res = self.client.get(
+            url('api:group_list', slug=self.group.slug),
+            {'fields': 'id,author'}
+        )
+        item = res.json()['results'][0]
+        self.assertEqual(set(item), {'id', 'author'})
+        self.assertEqual(item['author'], self.author.username)
+        res = self.client.get(url('api:index'), {'fields': 'id,password'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_profile_and_detail(self):
+        data = self.client.get(
+            url('api:profile', username=self.user.username)
+        ).json()
+        self.assertEqual(data['count'], 2)
+        first = Post.objects.filter(group=self.group).first()
+        item = self.client.get(
+            url('api:post_detail', post_id=first.pk)
+        ).json()
+        self.assertEqual(item['text'], first.text)
+        self.assertEqual(item['group'], self.group.slug)
+        self.assertIsNone(item['image'])
+        res = self.client.get(url('api:post_detail', post_id=0))
+        self.assertEqual(res.status_code, 404)
+
+    def test_follow_feed_needs_login(self):
+        res = self.client.get(url('api:follow_index'))
+        self.assertEqual(res.status_code, 401)
+        data = self.auth.get(url('api:follow_index')).json()
+        self.assertEqual(
+            {item['author'] for item in data['results']},
+            {self.author.username}
+        )
+
+    def test_export_streams_all_posts(self):
+        with mock.patch.object(api, 'EXPORT_CHUNK', 2):
+            res = self.client.get(url('api:export'), {'fields': 'id,text'})
+            self.assertTrue(res.streaming)
+            lines = b''.join(res.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [row['id'] for row in rows],
+            list(Post.objects.order_by('-created', '-pk')
+                 .values_list('pk', flat=True))
+        )
+        res = self.client.get(url('api:export'), {'group': self.group.slug})
+        self.assertEqual(len(b''.join(res.streaming_content).splitlines()),
+                         5)
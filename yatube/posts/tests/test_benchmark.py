@@ -0,0 +1,42 @@
+import random
+
+from django.db.models import Count
+from django.test import TestCase
+
+from ..management.commands.benchmark_views import (
+    SCENARIOS, compare, percentile, seed
+)
+from ..models import AuthorStats, Comment, Post, User
+
+
+class BenchmarkTest(TestCase):
+    options = {'authors': 30, 'groups': 3, 'posts': 200, 'comments': 300,
+               'images': 0}
+
+    def test_seed_is_reproducible_and_skewed(self):
+        data = seed(self.options, random.Random(1))
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertEqual(AuthorStats.objects.count(), User.objects.count())
+        followers = list(
+            User.objects.annotate(total=Count('following'))
+            .order_by('-total').values_list('total', flat=True)
+        )
+        self.assertGreater(followers[0], followers[len(followers) // 2])
+        for view, scenario in SCENARIOS.items():
+            with self.subTest(view=view):
+                method, path, _ = scenario(random.Random(2), data)
+                self.assertIn(method, ('get', 'post'))
+                self.assertTrue(path.startswith('/'))
+
+    def test_compare_flags_regressions(self):
+        before = {'p95_ms': 10, 'rps': 100, 'queries': 4, 'errors': 0}
+        same = {'p95_ms': 11, 'rps': 95, 'queries': 4, 'errors': 0}
+        worse = {'p95_ms': 20, 'rps': 50, 'queries': 6, 'errors': 1}
+        self.assertEqual(compare({'index': same}, {'index': before}, 0.2),
+                         [])
+        self.assertEqual(
+            len(compare({'index': worse}, {'index': before}, 0.2)), 4
+        )
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 0.99), 4)
@@ -0,0 +1,262 @@
+import math
+import os
+import sqlite3
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import Client, TestCase, override_settings
+
+from .. import caching, counters
+from ..models import Post
+
+from shortcuts import url, post, group, User
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.group = group('slug')
+
+    def setUp(self):
+        [post(self.user, self.group) for _ in range(3)]
+        self.client = Client()
+        cache.clear()
+
+    def render(self):
+        posts = list(Post.objects.select_related('author', 'group'))
+        return caching.render_cards(posts)
+
+    def test_warm_page_is_assembled_from_cache(self):
+        self.render()
+        with mock.patch.object(caching, 'render_to_string') as render:
+            with caching.card_stats.track() as counts:
+                cards = self.render()
+        self.assertEqual(counts, {'hits': 3, 'misses': 0})
+        render.assert_not_called()
+        self.assertEqual(len(cards), 3)
+
+    def test_card_is_refreshed_after_post_edit(self):
+        self.render()
+        edited = Post.objects.first()
+        edited.text = 'Исправленный текст'
+        edited.save()
+        self.assertIn('Исправленный текст', self.render()[0])
+
+    def test_card_is_refreshed_after_author_rename(self):
+        self.render()
+        self.user.first_name = 'Лев'
+        self.user.last_name = 'Толстой'
+        self.user.save()
+        self.assertIn('Лев Толстой', self.render()[0])
+
+    def test_group_page_cards_hide_group_link(self):
+        group_url = url('posts:group_list', slug=self.group.slug)
+        self.client.get(url('posts:index'))
+        res = self.client.get(group_url)
+        self.assertNotContains(res, f'href="{group_url}"')
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.group = group('slug')
+
+    def setUp(self):
+        cache.clear()
+        self.post = post(self.user, self.group)
+        self.guest_client = Client()
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.urls = [
+            url('posts:index'),
+            url('posts:group_list', slug=self.group.slug),
+            url('posts:profile', username=self.user.username),
+            url('posts:post_detail', post_id=self.post.id),
+        ]
+
+    def test_warm_pages_do_not_query_database(self):
+        for address in self.urls:
+            with self.subTest(address):
+                content = self.guest_client.get(address).content
+                with self.assertNumQueries(0):
+                    res = self.guest_client.get(address)
+                self.assertEqual(res.content, content)
+
+    def test_authorized_user_is_not_served_from_cache(self):
+        self.guest_client.get(url('posts:index'))
+        res = self.client.get(url('posts:index'))
+        self.assertContains(res, 'Новая запись')
+
+    def test_post_edit_invalidates_its_pages(self):
+        for address in self.urls:
+            self.guest_client.get(address)
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        for address in self.urls:
+            with self.subTest(address):
+                res = self.guest_client.get(address)
+                self.assertContains(res, 'Исправленный текст')
+
+    def test_comment_and_group_changes_invalidate_pages(self):
+        detail = url('posts:post_detail', post_id=self.post.id)
+        group_page = url('posts:group_list', slug=self.group.slug)
+        self.guest_client.get(detail)
+        self.guest_client.get(group_page)
+        self.post.comments.create(author=self.user, text='Комментарий')
+        self.group.description = 'Новое описание'
+        self.group.save()
+        self.assertContains(self.guest_client.get(detail), 'Комментарий')
+        self.assertContains(
+            self.guest_client.get(group_page), 'Новое описание'
+        )
+
+    def test_pages_are_keyed_by_page_number(self):
+        [post(self.user) for _ in range(10)]
+        first = self.guest_client.get(url('posts:index'))
+        second = self.guest_client.get(url('posts:index') + '?page=2')
+        self.assertNotEqual(first.content, second.content)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.group = group('slug')
+
+    def setUp(self):
+        cache.clear()
+        self.post = post(self.user, self.group)
+        self.client = Client()
+        self.urls = [
+            url('posts:index'),
+            url('posts:group_list', slug=self.group.slug),
+            url('posts:profile', username=self.user.username),
+            url('posts:post_detail', post_id=self.post.id),
+        ]
+
+    def test_unchanged_page_is_not_modified(self):
+        later = caching.time.time() + 2
+        for address in self.urls:
+            with self.subTest(address), mock.patch.object(
+                    caching.time, 'time', return_value=later):
+                res = self.client.get(address)
+                etag, modified = res['ETag'], res['Last-Modified']
+                self.assertIn('no-cache', res['Cache-Control'])
+                with self.assertNumQueries(0):
+                    res = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(res.status_code, 304)
+                self.assertEqual(res['ETag'], etag)
+                res = self.client.get(address, HTTP_IF_MODIFIED_SINCE=modified)
+                self.assertEqual(res.status_code, 304)
+
+    def test_changes_and_login_change_etag(self):
+        detail = self.urls[-1]
+        etag = self.client.get(detail)['ETag']
+        self.post.comments.create(author=self.user, text='Комментарий')
+        res = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        self.client.force_login(self.user)
+        res = self.client.get(detail, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('private', res['Cache-Control'])
+
+    def test_change_in_same_second_is_not_hidden(self):
+        detail = self.urls[-1]
+        second = math.ceil(caching.time.time()) + 10
+        with mock.patch.object(caching.time, 'time',
+                               return_value=second + 0.2):
+            self.post.comments.create(author=self.user, text='Первый')
+            res = self.client.get(detail)
+        self.assertTrue(res.has_header('ETag'))
+        self.assertFalse(res.has_header('Last-Modified'))
+        with mock.patch.object(caching.time, 'time',
+                               return_value=second + 1.5):
+            modified = self.client.get(detail)['Last-Modified']
+        with mock.patch.object(caching.time, 'time',
+                               return_value=second + 1.7):
+            self.post.comments.create(author=self.user, text='Второй')
+            res = self.client.get(detail, HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, 'Второй')
+
+
+class LaggingReplicaTest(TestCase):
+    """Реплика — снимок базы, сделанный до правки поста."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+
+    def setUp(self):
+        cache.clear()
+        self.post = post(self.user, text='Старый текст')
+        self.guest_client = Client()
+        self.client = Client()
+        self.client.force_login(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica.sqlite3')
+        self.snapshot(path)
+        connections.databases['replica'] = {
+            **connections.databases['default'], 'NAME': path
+        }
+        self.addCleanup(self.drop_replica)
+
+    @staticmethod
+    def snapshot(path):
+        """Копия таблиц тестовой базы — с её незакоммиченными строками."""
+        connection.ensure_connection()
+        source = connection.connection
+        target = sqlite3.connect(path)
+        tables = source.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' AND sql NOT LIKE '%VIRTUAL%'"
+        ).fetchall()
+        for name, sql in tables:
+            target.execute(sql)
+            rows = source.execute(f'SELECT * FROM "{name}"').fetchall()
+            if rows:
+                marks = ', '.join('?' * len(rows[0]))
+                target.executemany(
+                    f'INSERT INTO "{name}" VALUES ({marks})', rows
+                )
+        target.commit()
+        target.close()
+
+    @staticmethod
+    def drop_replica():
+        connections['replica'].close()
+        del connections.databases['replica']
+        delattr(connections._connections, 'replica')
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_replica_reads_do_not_fill_caches(self):
+        self.post.text = 'Новый текст'
+        self.post.save()
+        post(self.user)
+        cache.delete(counters.cache_key(counters.INDEX_FEED))
+        pages = [url('posts:index'),
+                 url('posts:profile', username=self.user.username),
+                 url('posts:post_detail', post_id=self.post.id)]
+        for address in pages:
+            with self.subTest(address):
+                res = self.client.get(address)
+                self.assertContains(res, 'Старый текст')
+                self.assertFalse(res.has_header('ETag'))
+        for address in pages:
+            with self.subTest(address):
+                res = self.guest_client.get(address)
+                self.assertContains(res, 'Новый текст')
+                self.assertNotContains(res, 'Старый текст')
+        self.assertEqual(
+            counters.feed_count([counters.INDEX_FEED]), Post.objects.count()
+        )
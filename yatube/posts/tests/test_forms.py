@@ -1,11 +1,15 @@
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.core.cache import cache
+from PIL import Image
 
+from .. import images
 from ..models import Post
 from shortcuts import group, post, User, url
 
@@ -91,3 +95,55 @@ class PostFormTests(TestCase):
         )
         self.assertRedirects(res, url('posts:profile', username='user'))
         self.assertEqual(Post.objects.count(), posts_count + 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class PostImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def photo(self, size):
+        image = Image.new('RGB', size, 'orange')
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=100, exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(),
+                                  content_type='image/jpeg')
+
+    def test_large_photo_is_shrunk_and_stripped(self):
+        photo = self.photo((3000, 1500))
+        saved_before = images.image_bytes_saved.values.get((), 0)
+        self.client.post(url('posts:post_create'),
+                         data={'text': 'Фото', 'image': photo})
+        stored = Post.objects.get(text='Фото').image
+        with Image.open(stored.path) as image:
+            self.assertEqual(image.size, (2048, 1024))
+            self.assertNotIn('exif', image.info)
+        self.assertEqual(
+            images.image_bytes_saved.values[()] - saved_before,
+            photo.size - stored.size
+        )
+
+    def test_too_many_pixels_is_rejected(self):
+        with mock.patch.object(images, 'MAX_PIXELS', 100):
+            res = self.client.post(url('posts:post_create'),
+                                   data={'text': 'Фото',
+                                         'image': self.photo((20, 20))})
+        self.assertFalse(Post.objects.filter(text='Фото').exists())
+        self.assertEqual(
+            res.context['form'].errors.as_data()['image'][0].code,
+            'too_many_pixels'
+        )
@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .. import changes, counters
+from ..models import (
+    AuthorStats, Comment, Follow, Group, Post, TimelineEntry
+)
+from ..search import SearchResults
+
+from shortcuts import post, group, User
+
+
+class ImportCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.author = User.objects.create_user('author')
+        cls.group = group('old')
+        cls.post = post(cls.author)
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def run_import(self, name, content, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, name)
+            with open(path, 'w', encoding='utf-8') as source:
+                source.write(content)
+            out, err = StringIO(), StringIO()
+            call_command('import_yatube', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_ndjson_import(self):
+        records = [
+            {'type': 'group', 'slug': 'new', 'title': 'Новая'},
+            {'type': 'post', 'id': 100, 'text': 'импортированный котик',
+             'author': 'author', 'group': 'new',
+             'created': '2020-01-02T03:04:05+00:00'},
+            {'type': 'post', 'text': 'второй', 'author': 'user'},
+            {'type': 'comment', 'post': 100, 'author': 'user', 'text': 'ок',
+             'created': '2020-01-03T00:00:00+00:00'},
+            {'type': 'follow', 'user': 'author', 'author': 'user'},
+            # уже есть: пропускается ограничением уникальности
+            {'type': 'follow', 'user': 'user', 'author': 'author'},
+            {'type': 'post', 'text': 'чей?', 'author': 'nobody'},
+            {'type': 'comment', 'post': 999, 'author': 'user', 'text': '?'},
+            {'type': 'post', 'id': [1], 'text': 'список', 'author': 'user'},
+        ]
+        counters.feed_count([counters.INDEX_FEED])
+        seq = Post.objects.get(pk=self.post.pk).change_seq
+        out, err = self.run_import(
+            'data.ndjson',
+            '\n'.join(json.dumps(record) for record in records) + '\nnot json',
+            '--batch-size', '3'
+        )
+        self.assertIn('строк/с', out)
+        self.assertEqual(err.count('строка'), 4)
+        imported = Post.objects.get(pk=100)
+        self.assertEqual(imported.group, Group.objects.get(slug='new'))
+        self.assertEqual(imported.created.year, 2020)
+        self.assertEqual(imported.comments.get().created.year, 2020)
+        self.assertTrue(Post._meta.get_field('created').auto_now_add)
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertEqual(Follow.objects.count(), 2)
+        self.assertEqual(counters.feed_count([counters.INDEX_FEED]), 3)
+        self.assertEqual(SearchResults('котик').count(), 1)
+        stats = AuthorStats.objects.get(author=self.user)
+        self.assertEqual((stats.posts_count, stats.followers_count), (1, 1))
+        changed = {(entry.model, entry.id) for entry in changes.since(seq)}
+        self.assertLessEqual(
+            {('group', imported.group_id), ('post', 100),
+             ('comment', Comment.objects.get().pk)},
+            changed
+        )
+
+    def test_csv_import_is_idempotent_with_ids(self):
+        content = 'id,text,author\n200,из таблицы,reader\n'
+        out, _ = self.run_import(
+            'posts.csv', content, '--type', 'post', '--create-users'
+        )
+        self.assertIn('постов 1', out)
+        self.assertEqual(Post.objects.get(pk=200).author.username, 'reader')
+        out, _ = self.run_import(
+            'posts.csv', content, '--type', 'post', '--create-users'
+        )
+        self.assertIn('дубликатов: 1', out)
+        self.assertEqual(Post.objects.filter(pk=200).count(), 1)
+
+    def test_exported_image_url_becomes_storage_name(self):
+        name = 'posts/ab/ab12.jpg'
+        content = (
+            'text,author,image\n'
+            f'по URL,author,http://testserver{settings.MEDIA_URL}{name}\n'
+            f'по имени,author,{name}\n'
+        )
+        self.run_import('posts.csv', content, '--type', 'post')
+        self.assertEqual(
+            set(Post.objects.filter(text__startswith='по ')
+                .values_list('image', flat=True)),
+            {name}
+        )
+
+    @override_settings(POSTS_FANOUT=True)
+    def test_fanout_inboxes_are_filled(self):
+        records = [
+            {'type': 'post', 'text': 'подписчикам', 'author': 'author'},
+            {'type': 'post', 'text': 'от user', 'author': 'user'},
+            {'type': 'follow', 'user': 'author', 'author': 'user'},
+        ]
+        self.run_import(
+            'data.ndjson',
+            '\n'.join(json.dumps(record) for record in records),
+            '--batch-size', '1'
+        )
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list('user__username',
+                                                  'post__text')),
+            {('user', 'подписчикам'), ('author', 'от user')}
+        )
@@ -1,5 +1,15 @@
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
-from shortcuts import post, group, User
+
+from .. import changes
+from ..models import AuthorStats, Change, Comment, Follow, Group, Post
+from shortcuts import url, post, group, User
 
 
 class PostModelTest(TestCase):
@@ -18,3 +28,163 @@ class PostModelTest(TestCase):
     def test_model_post_object_names_no_more_than_15_characters(self):
         self.assertEqual(str(self.post), 'Короткий пост')
         self.assertEqual(str(self.long_post), 'Не более 15 сим')
+
+
+class AuthorStatsTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.user = User.objects.create_user('user')
+
+    def stats(self, user):
+        return AuthorStats.objects.get(author=user)
+
+    def test_stats_follow_posts_follows_and_comments(self):
+        first = post(self.author)
+        post(self.author)
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        Comment.objects.create(post=first, author=self.user, text='Ок')
+        author, user = self.stats(self.author), self.stats(self.user)
+        self.assertEqual(author.posts_count, 2)
+        self.assertEqual(author.followers_count, 1)
+        self.assertEqual(user.following_count, 1)
+        self.assertEqual(user.comments_count, 1)
+        first.delete()
+        follow.delete()
+        author, user = self.stats(self.author), self.stats(self.user)
+        self.assertEqual(author.posts_count, 1)
+        self.assertEqual(author.followers_count, 0)
+        self.assertEqual(user.comments_count, 0)
+
+    def test_drifted_counter_stays_at_zero(self):
+        first = post(self.author)
+        AuthorStats.objects.filter(author=self.author).update(posts_count=0)
+        first.delete()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+
+    def test_author_without_stats_gets_them_on_first_shift(self):
+        User.objects.bulk_create([User(username='bulk')])
+        bulk = User.objects.get(username='bulk')
+        self.assertFalse(AuthorStats.objects.filter(author=bulk).exists())
+        post(bulk)
+        post(bulk).delete()
+        self.assertEqual(self.stats(bulk).posts_count, 1)
+
+    def test_loaddata_creates_stats(self):
+        fixture = StringIO()
+        call_command('dumpdata', 'auth.user', '--pks', str(self.user.pk),
+                     stdout=fixture)
+        User.objects.filter(pk=self.user.pk).delete()
+        with mock.patch('sys.stdin', StringIO(fixture.getvalue())):
+            call_command('loaddata', '-', format='json', verbosity=0)
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+    def test_rebuild_command_fixes_drift(self):
+        post(self.author)
+        AuthorStats.objects.filter(author=self.author).update(posts_count=7)
+        AuthorStats.objects.filter(author=self.user).delete()
+        out = StringIO()
+        call_command('rebuild_author_stats', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+
+class ChangeTrackingTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        self.group = group()
+        self.post = post(self.user, self.group)
+
+    def test_saves_get_increasing_numbers(self):
+        before = self.post.change_seq
+        created = self.post.created
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.change_seq, before)
+        self.assertGreater(self.post.change_seq, self.group.change_seq)
+        self.assertGreater(self.post.modified, created)
+
+    def test_since_returns_latest_changes_and_deletions(self):
+        start = self.post.change_seq
+        comment = Comment.objects.create(post=self.post, author=self.user,
+                                         text='Комментарий')
+        self.group.save()
+        comment_id = comment.pk
+        comment.delete()
+        entries = changes.since(start)
+        self.assertEqual(
+            [(entry.model, entry.id, entry.deleted) for entry in entries],
+            [('group', self.group.pk, False),
+             ('comment', comment_id, True)]
+        )
+        self.assertEqual(changes.since(entries[-1].seq), [])
+        self.assertEqual(len(changes.since(0, limit=1)), 1)
+
+    def test_changes_endpoint_pages_by_sequence(self):
+        other = post(self.user)
+        res = self.client.get(url('posts:changes'), {'limit': 1})
+        data = res.json()
+        self.assertEqual([change['id'] for change in data['changes']],
+                         [self.group.pk])
+        data = self.client.get(
+            url('posts:changes'), {'since': data['next']}
+        ).json()
+        self.assertEqual(
+            [change['id'] for change in data['changes']],
+            list(Post.objects.order_by('change_seq').values_list(
+                'pk', flat=True
+            ))
+        )
+        self.assertIn(other.pk, [change['id'] for change in data['changes']])
+        res = self.client.get(url('posts:changes'), {'since': 'вчера'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_number_is_allocated_in_saving_transaction(self):
+        depth = []
+        allocate = changes.allocate
+
+        def spy(*args, **kwargs):
+            depth.append(len(connection.savepoint_ids))
+            return allocate(*args, **kwargs)
+
+        outer = len(connection.savepoint_ids)
+        with mock.patch.object(changes, 'allocate', spy):
+            self.post.save()
+        self.assertEqual(len(depth), 1)
+        self.assertGreater(depth[0], outer)
+
+    def test_journal_keeps_only_deletions(self):
+        self.post.save()
+        Comment.objects.create(post=self.post, author=self.user, text='Т')
+        post(self.user).delete()
+        self.assertEqual(
+            list(Change.objects.values_list('deleted', flat=True)), [True]
+        )
+
+    def test_group_deletion_renumbers_its_posts(self):
+        seq = self.post.change_seq
+        self.group.delete()
+        self.post.refresh_from_db()
+        self.assertIsNone(self.post.group)
+        self.assertGreater(self.post.change_seq, seq)
+        self.assertIn(
+            ('post', self.post.pk, False),
+            [(entry.model, entry.id, entry.deleted)
+             for entry in changes.since(seq)]
+        )
+
+    def test_migration_numbers_existing_rows(self):
+        migration = import_module('posts.migrations.0009_number_existing_rows')
+        Group.objects.update(change_seq=0)
+        Post.objects.update(change_seq=0)
+        migration.number_existing_rows(apps, None)
+        numbers = list(Post.objects.values_list('change_seq', flat=True))
+        numbers += Group.objects.values_list('change_seq', flat=True)
+        self.assertNotIn(0, numbers)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(
+            {(entry.model, entry.id) for entry in changes.since(0)},
+            {('group', self.group.pk), ('post', self.post.pk)}
+        )
+        self.assertFalse(Change.objects.filter(deleted=False).exists())
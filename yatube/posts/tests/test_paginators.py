@@ -0,0 +1,97 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.utils import timezone
+
+from core.templatetags.user_filters import page_window
+
+from .. import counters
+from ..models import Post
+from ..paginators import CursorPage, CursorPaginator, FeedPaginator
+
+from shortcuts import url, post, group, User
+
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        [post(cls.user) for _ in range(25)]
+        # часть постов с одинаковой датой: порядок решает id
+        Post.objects.filter(pk__lte=5).update(created=timezone.now())
+
+    def setUp(self):
+        self.client = Client()
+        cache.clear()
+
+    def test_walk_forward_and_back_matches_offset_order(self):
+        expected = list(Post.objects.order_by('-created', '-pk'))
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        page = paginator.get_page()
+        walked = list(page)
+        while page.next_cursor:
+            page = paginator.get_page(cursor=page.next_cursor)
+            self.assertIsInstance(page, CursorPage)
+            walked += list(page)
+        self.assertEqual(walked, expected)
+        self.assertFalse(page.has_next())
+        back = paginator.get_page(cursor=page.previous_cursor)
+        self.assertEqual(list(back), expected[10:20])
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        page = paginator.get_page(cursor='не-курсор')
+        self.assertEqual(page.number, 1)
+        self.assertEqual(len(page), 10)
+
+    def test_feed_follows_next_cursor(self):
+        res = self.client.get(url('posts:index'))
+        cursor = res.context['page_obj'].next_cursor
+        self.assertContains(res, f'?cursor={cursor}')
+        res = self.client.get(url('posts:index') + f'?cursor={cursor}')
+        page = res.context['page_obj']
+        self.assertIsInstance(page, CursorPage)
+        self.assertEqual(len(page), 10)
+
+
+class FeedCountTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.group = group()
+
+    def setUp(self):
+        cache.clear()
+        [post(self.user, self.group) for _ in range(3)]
+
+    def test_count_is_cached_and_kept_by_signals(self):
+        feeds = [counters.group_feed(self.group.pk)]
+        self.assertEqual(counters.feed_count(feeds), 3)
+        new_post = post(self.user, self.group)
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.feed_count(feeds), 4)
+        new_post.group = None
+        new_post.save()
+        self.assertEqual(counters.feed_count(feeds), 3)
+        Post.objects.filter(group=self.group).first().delete()
+        self.assertEqual(counters.feed_count(feeds), 2)
+        self.assertEqual(counters.feed_count([counters.INDEX_FEED]), 3)
+
+    def test_count_is_estimated_above_threshold(self):
+        [post(self.user) for _ in range(7)]
+        with mock.patch.object(counters, 'COUNT_ESTIMATE_THRESHOLD', 4):
+            estimate = counters.bounded_count(Post.objects.all())
+        self.assertEqual(estimate, 10)
+
+    def test_page_window(self):
+        paginator = FeedPaginator(Post.objects.all(), 1)
+        paginator.count = 100
+        self.assertEqual(
+            page_window(paginator.page(50)),
+            [1, None, 48, 49, 50, 51, 52, None, 100]
+        )
+        self.assertEqual(page_window(paginator.page(2)),
+                         [1, 2, 3, 4, None, 100])
@@ -0,0 +1,97 @@
+import re
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Comment, Follow
+from shortcuts import group, post, url, User
+
+TABLE_RE = re.compile(r'(SCAN|SEARCH) (TABLE )?(\w+)')
+INDEX_RE = re.compile(
+    r'USING (COVERING )?INDEX (?P<name>\w+)|USING INTEGER PRIMARY KEY'
+)
+
+
+class QueryPlanTest(TestCase):
+    """Запросы лент идут по индексам и не сортируются во временном B-tree.
+
+    Исключение — лента подписок: посты нескольких авторов сливаются
+    сортировкой, но каждый автор читается по своему индексу.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.author = User.objects.create_user('author')
+        cls.group = group('slug')
+        cls.posts = [post(cls.author, cls.group) for _ in range(15)]
+        Comment.objects.create(post=cls.posts[0], author=cls.user, text='к')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.other = User.objects.create_user('other')
+        [post(cls.other) for _ in range(15)]
+        Follow.objects.create(user=cls.user, author=cls.other)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def index_name(self, table, *columns):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, table
+            )
+        return next(
+            name for name, info in constraints.items()
+            if info['index'] and info['columns'] == list(columns)
+        )
+
+    def assert_indexed(self, address, index, merge=False):
+        """Каждая таблица читается по индексу, посты — по ``index``."""
+        tables = set(connection.introspection.table_names())
+        used = set()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(address)
+        for query in queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            plan = self.plan(query['sql'])
+            with self.subTest(address=address, sql=query['sql']):
+                for row in plan:
+                    table = TABLE_RE.match(row)
+                    if table and table.group(3) in tables:
+                        match = INDEX_RE.search(row)
+                        self.assertIsNotNone(match, plan)
+                        used.add(match.group('name'))
+                if not merge:
+                    self.assertFalse(
+                        any('TEMP B-TREE' in row for row in plan), plan
+                    )
+        self.assertIn(index, used)
+        return res
+
+    def test_feed_queries_use_indexes(self):
+        addresses = [
+            (url('posts:index'), self.index_name('posts_post', 'created')),
+            (url('posts:group_list', slug='slug'), 'post_group_created'),
+            (url('posts:profile', username='author'), 'post_author_created'),
+            (url('posts:post_detail', post_id=self.posts[0].pk),
+             'comment_post_created'),
+            (url('posts:follow_index'), 'post_author_created'),
+        ]
+        for address, index in addresses:
+            merge = address == url('posts:follow_index')
+            res = self.assert_indexed(address, index, merge)
+            page = res.context.get('page_obj')
+            cursor = getattr(page, 'next_cursor', None)
+            if cursor:
+                self.assert_indexed(f'{address}?cursor={cursor}', index,
+                                    merge)
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.core.cache import cache
+from django.test import Client, RequestFactory, TestCase
+
+from ..models import Post
+from .. import search
+from ..search import SearchResults, fts_query
+
+from shortcuts import url, post, User
+
+
+class PostSearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.cats = post(self.user, text='Коты спят. Коты едят. Коты!')
+        self.dogs = post(self.user, text='Собаки гуляют, а коты спят')
+        self.birds = post(self.user, text='Птицы поют')
+
+    def found(self, text):
+        return list(SearchResults(text)[0:10])
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.found('коты'), [self.cats, self.dogs])
+        self.assertEqual(self.found('собаки коты'), [self.dogs])
+        self.assertEqual(SearchResults('кот').count(), 2)
+
+    def test_index_follows_edits_and_deletes(self):
+        self.birds.text = 'Птицы и коты'
+        self.birds.save()
+        self.assertIn(self.birds, self.found('коты'))
+        self.cats.delete()
+        self.assertNotIn(self.cats.pk, [p.pk for p in self.found('коты')])
+
+    def test_query_operators_are_escaped(self):
+        self.assertEqual(
+            fts_query('коты OR "NEAR(x'), '"коты" "or" "near" "x"*'
+        )
+        self.assertEqual(self.found('"'), [])
+
+    def test_broad_queries_are_capped_and_sorted_by_date(self):
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            results = SearchResults('коты')
+            self.assertEqual(results.count(), 1)
+            self.assertEqual(list(results[0:10]), [self.dogs])
+
+    def test_search_view_is_paginated(self):
+        [post(self.user, text=f'Котики {i}') for i in range(12)]
+        res = self.client.get(url('posts:search'), {'q': 'котики'})
+        self.assertEqual(len(res.context['page_obj']), 10)
+        self.assertContains(
+            res, '?q=%D0%BA%D0%BE%D1%82%D0%B8%D0%BA%D0%B8&amp;page=2'
+        )
+        res = self.client.get(
+            url('posts:search'), {'q': 'котики', 'page': 2}
+        )
+        self.assertEqual(len(res.context['page_obj']), 2)
+
+    def test_admin_search_uses_index(self):
+        request = RequestFactory().get('/admin/posts/post/', {'q': 'птицы'})
+        queryset, _ = site._registry[Post].get_search_results(
+            request, Post.objects.all(), 'птицы'
+        )
+        self.assertEqual(list(queryset), [self.birds])
+        queryset, _ = site._registry[Post].get_search_results(
+            request, Post.objects.all(), 'коты'
+        )
+        self.assertEqual(set(queryset), {self.cats, self.dogs})
+        self.assertEqual(queryset.count(), 2)
@@ -0,0 +1,301 @@
+import json
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .. import caching, thumbnails
+from ..models import Post
+from shortcuts import post, url, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def run_now(func):
+    func()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@mock.patch('posts.thumbnails.transaction.on_commit', run_now)
+class ThumbnailPipelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def image(self):
+        return SimpleUploadedFile('small.gif', SMALL_GIF, 'image/gif')
+
+    def test_post_create_orders_thumbnails(self):
+        with mock.patch.object(thumbnails, 'executor') as executor:
+            self.client.post(
+                url('posts:post_create'),
+                data={'text': 'С картинкой', 'image': self.image()}
+            )
+        name = Post.objects.get(text='С картинкой').image.name
+        executor().submit.assert_called_once_with(
+            thumbnails.generate_in_background, name
+        )
+
+    def test_post_edit_without_new_image_orders_nothing(self):
+        edited = post(self.user)
+        with mock.patch.object(thumbnails, 'executor') as executor:
+            self.client.post(
+                url('posts:post_edit', post_id=edited.id),
+                data={'text': 'Новый текст'}
+            )
+        executor().submit.assert_not_called()
+
+    @override_settings(POSTS_THUMBNAILS_ASYNC=False)
+    def test_sync_mode_cuts_thumbnails_in_request(self):
+        with mock.patch.object(thumbnails, 'get_thumbnail') as get_thumbnail:
+            self.client.post(
+                url('posts:post_create'),
+                data={'text': 'С картинкой', 'image': self.image()}
+            )
+        name = Post.objects.get(text='С картинкой').image.name
+        get_thumbnail.assert_called_once_with(
+            mock.ANY, '960x339', crop='center', upscale=True
+        )
+        image = get_thumbnail.call_args[0][0]
+        self.assertEqual(image.name, name)
+        self.assertIs(image.storage, thumbnails.image_storage())
+
+    def test_backfill_command(self):
+        post(self.user, image='posts/a.gif')
+        post(self.user, image='posts/a.gif')
+        post(self.user, image='posts/b.gif')
+        out = StringIO()
+        command = 'posts.management.commands.generate_thumbnails'
+        pool = mock.patch(f'{command}.ProcessPoolExecutor', ThreadPoolExecutor)
+        stub = mock.patch(f'{command}.generate', return_value=1)
+        with pool, stub as generate:
+            call_command('generate_thumbnails', workers=2, stdout=out)
+        self.assertEqual(
+            sorted(call.args[0] for call in generate.call_args_list),
+            ['posts/a.gif', 'posts/b.gif']
+        )
+        self.assertIn('Картинок: 2, миниатюр: 2, ошибок: 0', out.getvalue())
+
+    def test_backfill_command_workers_set_up_django(self):
+        command = 'posts.management.commands.generate_thumbnails'
+        spawn = multiprocessing.get_context('spawn')
+        checks = []
+
+        def spawned_pool(**kwargs):
+            pool = ProcessPoolExecutor(mp_context=spawn, **kwargs)
+            # без django.setup() в процессе call_command падает
+            # с AppRegistryNotReady
+            checks.append(pool.submit(
+                call_command, 'check', stdout=StringIO(), stderr=StringIO()
+            ))
+            return pool
+
+        with mock.patch(f'{command}.ProcessPoolExecutor', spawned_pool):
+            call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        self.assertIsNone(checks[0].result())
+
+
+class ThumbnailLookupTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+        cls.posts = [
+            post(cls.user, image=f'posts/{number}.gif') for number in range(3)
+        ]
+        # миниатюры первых двух картинок уже нарезаны
+        for image in ('posts/0.gif', 'posts/1.gif'):
+            thumbnail = ImageFile(thumbnails.thumbnail_name(
+                image, *thumbnails.CARD_THUMBNAIL
+            ), default.storage)
+            thumbnail.set_size((960, 339))
+            default.kvstore._set(thumbnail.key, thumbnail)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_page_thumbnails_are_found_at_once(self):
+        with self.assertNumQueries(1):
+            thumbnails.attach(self.posts)
+        with self.assertNumQueries(0):
+            thumbnails.attach(self.posts)
+        first, second, third = self.posts
+        self.assertTrue(first.thumbnail.name.startswith('cache/'))
+        self.assertNotEqual(first.thumbnail.name, second.thumbnail.name)
+        self.assertIsNone(third.thumbnail)
+
+    def test_changed_sorl_internals_leave_thumbnails_to_tag(self):
+        # бэкенд без _get_thumbnail_filename
+        backend = mock.Mock(spec=['default_options', 'extra_options'],
+                            default_options={}, extra_options=())
+        for patch in (mock.patch.object(default, 'backend', backend),
+                      mock.patch.object(thumbnails, 'KVStore', None)):
+            with self.subTest(patch=patch), patch, \
+                    self.assertLogs('posts.thumbnails', 'WARNING'):
+                thumbnails.attach(self.posts)
+                self.assertEqual(
+                    [post.thumbnail for post in self.posts], [None] * 3
+                )
+
+    def test_card_uses_found_thumbnail(self):
+        cards = caching.render_cards(self.posts[:1])
+        self.assertIn(f'src="{self.posts[0].thumbnail.url}"', cards[0])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageVariantsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 600), 'green').save(buffer, 'JPEG')
+        self.name = default_storage.save(
+            'posts/photo.jpg', ContentFile(buffer.getvalue())
+        )
+        self.post = post(self.user, image=self.name)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_variants_are_cut_and_listed_in_manifest(self):
+        seq = self.post.change_seq
+        with mock.patch.object(thumbnails, 'get_thumbnail'):
+            self.assertEqual(thumbnails.generate(self.name), 7)
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.change_seq, seq)
+        manifest = json.loads(self.post.image_variants)
+        self.assertEqual(
+            manifest, {'w': [320, 640, 960], 'f': ['webp', 'jpg']}
+        )
+        with default_storage.open('posts/variants/photo-640.webp') as file:
+            image = Image.open(file)
+            self.assertEqual((image.format, image.size), ('WEBP', (640, 226)))
+
+    def test_reused_manifest_is_numbered(self):
+        with mock.patch.object(thumbnails, 'get_thumbnail'):
+            thumbnails.generate(self.name)
+        other = post(self.user, image=self.name)
+        seq = Post.objects.get(pk=other.pk).change_seq
+        thumbnails.pregenerate(other)
+        other.refresh_from_db()
+        self.assertTrue(other.image_variants)
+        self.assertGreater(other.change_seq, seq)
+
+    def test_card_offers_srcset(self):
+        with mock.patch.object(thumbnails, 'get_thumbnail'):
+            thumbnails.generate(self.name)
+        self.post.refresh_from_db()
+        card = caching.render_cards([self.post])[0]
+        self.assertIn('<source type="image/webp"', card)
+        self.assertIn(
+            f'{settings.MEDIA_URL}posts/variants/photo-960.jpg 960w', card
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@mock.patch('posts.thumbnails.transaction.on_commit', run_now)
+class ImageReleaseTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.storage = thumbnails.image_storage()
+
+    def create(self, text, content=SMALL_GIF):
+        with mock.patch.object(thumbnails, 'executor'):
+            self.client.post(url('posts:post_create'), data={
+                'text': text,
+                'image': SimpleUploadedFile('small.gif', content, 'image/gif')
+            })
+        return Post.objects.get(text=text)
+
+    def test_same_upload_is_shared_until_last_post_goes(self):
+        first, second = self.create('Первый'), self.create('Второй')
+        self.assertEqual(first.image.name, second.image.name)
+        first.delete()
+        self.assertTrue(self.storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(self.storage.exists(second.image.name))
+
+    def other_gif(self):
+        buffer = BytesIO()
+        Image.new('P', (2, 1)).save(buffer, 'GIF')
+        return buffer.getvalue()
+
+    def test_replaced_image_is_released(self):
+        edited = self.create('Пост')
+        old_name = edited.image.name
+        with mock.patch.object(thumbnails, 'executor'):
+            self.client.post(url('posts:post_edit', post_id=edited.pk), data={
+                'text': 'Пост',
+                'image': SimpleUploadedFile('other.gif', self.other_gif())
+            })
+        edited.refresh_from_db()
+        self.assertNotEqual(edited.image.name, old_name)
+        self.assertFalse(self.storage.exists(old_name))
+        self.assertTrue(self.storage.exists(edited.image.name))
+
+    def test_references_are_checked_under_write_lock(self):
+        name = self.create('Пост').image.name
+        Post.objects.filter(image=name).update(image='')
+        depth = []
+        outer = len(connection.savepoint_ids)
+        with mock.patch.object(
+            thumbnails, 'sorl_delete',
+            lambda *args, **kwargs: depth.append(len(connection.savepoint_ids))
+        ):
+            thumbnails.release(name)
+        self.assertEqual(len(depth), 1)
+        self.assertGreater(depth[0], outer)
+        self.assertFalse(self.storage.exists(name))
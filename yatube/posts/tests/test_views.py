@@ -1,14 +1,18 @@
 import tempfile
 import shutil
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
 from django.conf import settings
 
-from ..models import Post, Follow
+from ..models import Comment, Post, Follow, TimelineEntry
 from ..forms import PostForm
+from .. import counters, timeline, views
 
 from shortcuts import url, post, group
 
@@ -121,6 +125,15 @@ class PostPagesTests(TestCase):
                 res = self.client.get(address + '?page=2')
                 self.assertEqual(len(res.context['page_obj']), 3)
 
+    def test_cursor_feeds_link_no_page_numbers(self):
+        for address in self.urls:
+            res = self.client.get(address)
+            if res.context.get('page_obj'):
+                with self.subTest(address=address):
+                    self.assertContains(res, '?cursor=')
+                    self.assertNotContains(res, 'page=2')
+                    self.assertNotContains(res, 'Последняя')
+
     def test_post_with_group_added_on_index_post_list_and_profile_pages(self):
         """Пост с указанной группой отображается на страницах: главной, группы,
          пользователя"""
@@ -199,7 +212,44 @@ class PostCommentsTest(TestCase):
         )
         res = self.client.get(url('posts:post_detail', post_id=self.post.id))
         self.assertEqual(self.post.comments.count(), count + 1)
-        self.assertTrue(res.context.get('comments').first())
+        self.assertEqual(res.context['comments'][0].text, 'Комментарий')
+
+    def test_comments_are_paginated_and_loaded_by_cursor(self):
+        comments = [
+            Comment.objects.create(post=self.post, author=self.user,
+                                   text=f'Комментарий {number}')
+            for number in range(5)
+        ]
+        detail = url('posts:post_detail', post_id=self.post.id)
+        with mock.patch.object(views, 'COMMENTS_PER_PAGE', 2):
+            res = self.guest_client.get(detail)
+            page = res.context['comments']
+            self.assertEqual(list(page), comments[:-3:-1])
+            self.assertContains(res, 'Комментарии: 5')
+            more = url('posts:post_comments', post_id=self.post.id)
+            self.assertContains(res, f'{more}?cursor={page.next_cursor}')
+            res = self.guest_client.get(more, {'cursor': page.next_cursor})
+            self.assertEqual(list(res.context['comments']),
+                             [comments[2], comments[1]])
+            self.assertNotContains(res, '<html')
+            cursor = res.context['comments'].next_cursor
+            data = self.guest_client.get(
+                more, {'cursor': cursor, 'format': 'json'}
+            ).json()
+        self.assertEqual(data['count'], 5)
+        self.assertIsNone(data['next'])
+        self.assertEqual([comment['text'] for comment in data['comments']],
+                         ['Комментарий 0'])
+
+    def test_comment_count_is_cached_and_kept_by_signals(self):
+        feeds = [counters.comments_feed(self.post.pk)]
+        self.assertEqual(counters.feed_count(feeds), 0)
+        comment = Comment.objects.create(post=self.post, author=self.user,
+                                         text='Комментарий')
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.feed_count(feeds), 1)
+        comment.delete()
+        self.assertEqual(counters.feed_count(feeds), 0)
 
 
 class PostFollowTest(TestCase):
@@ -239,6 +289,112 @@ class PostFollowTest(TestCase):
         self.assertEqual(len(res_3.context["page_obj"]), 0)
 
 
+@override_settings(POSTS_FANOUT=True)
+class PostTimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user('author')
+        cls.user = User.objects.create_user('user')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.author)
+        self.user_client = Client()
+        self.user_client.force_login(self.user)
+        cache.clear()
+
+    def feed(self):
+        res = self.user_client.get(url('posts:follow_index'))
+        return list(res.context['page_obj'])
+
+    def test_follow_backfills_and_new_posts_fan_out(self):
+        old = post(self.author)
+        self.user_client.get(url('posts:profile_follow', username='author'))
+        self.client.post(url('posts:post_create'), data={'text': 'Новый'})
+        new = Post.objects.get(text='Новый')
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [new.pk, old.pk]
+        )
+        self.assertEqual(self.feed(), [new, old])
+        self.user_client.get(url('posts:profile_unfollow', username='author'))
+        self.assertFalse(self.user.timeline.exists())
+        self.assertEqual(self.feed(), [])
+
+    def test_inbox_is_trimmed(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        with mock.patch.object(timeline, 'TIMELINE_SIZE', 2):
+            posts = [post(self.author) for _ in range(3)]
+            for new in posts:
+                timeline.fan_out(new)
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [posts[2].pk, posts[1].pk]
+        )
+
+    def test_trim_reads_inboxes_by_index(self):
+        fan = User.objects.create_user('fan')
+        for user in (self.user, fan):
+            Follow.objects.create(user=user, author=self.author)
+        posts = [post(self.author) for _ in range(3)]
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=self.user, post=new, created=new.created)
+            for new in posts
+        )
+        TimelineEntry.objects.create(user=fan, post=posts[0],
+                                     created=posts[0].created)
+        with mock.patch.object(timeline, 'TIMELINE_SIZE', 2), \
+                CaptureQueriesContext(connection) as queries:
+            timeline.trim(Follow.objects.values('user_id'))
+        self.assertEqual(
+            list(self.user.timeline.values_list('post', flat=True)),
+            [posts[2].pk, posts[1].pk]
+        )
+        self.assertEqual(fan.timeline.count(), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries[-1]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('timeline_user_created', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_count_is_inbox_size(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        with mock.patch.object(timeline, 'TIMELINE_SIZE', 2):
+            for new in [post(self.author) for _ in range(3)]:
+                timeline.fan_out(new)
+            res = self.user_client.get(url('posts:follow_index'))
+        self.assertEqual(res.context['page_obj'].paginator.count, 2)
+        self.assertEqual(len(res.context['page_obj']), 2)
+
+    def test_author_below_limit_is_fanned_out_again(self):
+        fan = User.objects.create_user('fan')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=fan, author=self.author)
+        with mock.patch.object(timeline, 'FANOUT_FOLLOWERS_LIMIT', 2):
+            old = post(self.author)
+            timeline.fan_out(old)
+            self.assertFalse(TimelineEntry.objects.exists())
+            fan_client = Client()
+            fan_client.force_login(fan)
+            fan_client.get(
+                url('posts:profile_unfollow', username='author')
+            )
+            self.assertEqual(
+                list(self.user.timeline.values_list('post', flat=True)),
+                [old.pk]
+            )
+            self.assertEqual(self.feed(), [old])
+
+    def test_celebrity_posts_are_merged_on_read(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        with mock.patch.object(timeline, 'FANOUT_FOLLOWERS_LIMIT', 1):
+            new = post(self.author)
+            timeline.fan_out(new)
+            self.assertFalse(TimelineEntry.objects.exists())
+            self.assertEqual(self.feed(), [new])
+
+
 class PostCashTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -252,14 +408,53 @@ class PostCashTest(TestCase):
         cache.clear()
 
     def test_index_cache(self):
-        """Главная страница кеширована на 20 секунд"""
-        content_1 = self.client.get(url('posts:index')).content
-        Post.objects.get(id=self.post.id).delete()
-        content_2 = self.client.get(url('posts:index')).content
+        """Главная страница кеширована, пока лента не изменилась"""
+        guest = Client()
+        content_1 = guest.get(url('posts:index')).content
+        with self.assertNumQueries(0):
+            content_2 = guest.get(url('posts:index')).content
         self.assertEqual(content_1, content_2)
-        cache.clear()
-        content_3 = self.client.get(url('posts:index')).content
+        Post.objects.get(id=self.post.id).delete()
+        content_3 = guest.get(url('posts:index')).content
         self.assertNotEqual(content_2, content_3)
+        self.assertEqual(self.client.get(url('posts:index')).content.count(
+            self.post.text.encode()), 0)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetViewsTest(TestCase):
+    """Страницы укладываются в бюджет запросов и обходятся без N+1"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user')
+        authors = [User.objects.create_user(f'author{i}') for i in range(3)]
+        cls.group = group('slug')
+        for author in authors:
+            Follow.objects.create(user=cls.user, author=author)
+            for _ in range(5):
+                post(author, cls.group)
+        cls.post = Post.objects.first()
+        for author in authors:
+            Comment.objects.create(post=cls.post, author=author, text='Ок')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_within_budget(self):
+        pages = [
+            url('posts:index'),
+            url('posts:group_list', slug='slug'),
+            url('posts:profile', username='author0'),
+            url('posts:post_detail', post_id=self.post.pk),
+            url('posts:follow_index'),
+            url('posts:search') + '?q=' + self.post.text.split()[0],
+        ]
+        self.client.force_login(self.user)
+        for page in pages:
+            with self.subTest(page=page):
+                res = self.client.get(page)
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.query_log.repeated(), {})
 
 
 # class TestTmp(TestCase):
@@ -0,0 +1,320 @@
+"""Заблаговременная нарезка миниатюр картинок постов.
+
+Без неё sorl-thumbnail делает миниатюру при первой отрисовке поста,
+и декодирование с масштабированием достаётся случайному читателю.
+Здесь миниатюры заказываются сразу после сохранения поста и режутся
+в фоновом пуле потоков (``POSTS_THUMBNAILS_ASYNC = False`` — прямо
+в запросе), а команда ``generate_thumbnails`` догоняет старые картинки.
+
+Кроме того, из картинки режутся варианты для ``srcset``: кадр карточки
+нескольких ширин в WebP и в формате оригинала. Их перечень хранится
+в посте компактным манифестом (``Post.image_variants``), так что шаблонам
+не нужно ни обращаться к Pillow, ни проверять хранилище.
+
+Уже нарезанные миниатюры страницы ленты ``attach`` находит в хранилище
+ключей sorl разом, одним ``get_many`` и одним запросом к базе, вместо
+отдельного обращения от каждого тега ``{% thumbnail %}``. Для этого
+повторяются внутренности sorl (``_get_format``,
+``_get_thumbnail_filename``, ``_get_raw``, ``EMPTY_VALUE``), поэтому
+версия sorl-thumbnail закреплена в requirements.txt. Если они всё же
+изменятся, ``attach`` ничего не находит, и миниатюры, как без него,
+делает тег.
+"""
+import json
+import logging
+import posixpath
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, router, transaction
+from sorl.thumbnail import default, delete as sorl_delete, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from PIL import Image, ImageOps, features
+
+from . import changes
+from .models import Post
+
+try:
+    from sorl.thumbnail.kvstores.cached_db_kvstore import (
+        EMPTY_VALUE, KVStore
+    )
+except ImportError:  # закрытые имена sorl; без них attach не работает
+    EMPTY_VALUE = KVStore = None
+
+
+logger = logging.getLogger(__name__)
+
+# Размеры из шаблонов: includes/article.html и posts/post_detail.html
+CARD_THUMBNAIL = ('960x339', {'crop': 'center', 'upscale': True})
+THUMBNAILS = [CARD_THUMBNAIL]
+VARIANT_WIDTHS = getattr(settings, 'POSTS_IMAGE_VARIANT_WIDTHS',
+                         [320, 640, 960])
+VARIANT_RATIO = 339 / 960
+VARIANT_QUALITY = getattr(settings, 'POSTS_IMAGE_VARIANT_QUALITY', 80)
+VARIANTS_DIR = 'posts/variants'
+# формат оригинала: (формат Pillow, расширение, MIME)
+ORIGINAL_FORMATS = {
+    'JPEG': ('JPEG', 'jpg', 'image/jpeg'),
+    'PNG': ('PNG', 'png', 'image/png'),
+}
+WEBP = ('WEBP', 'webp', 'image/webp')
+MIME_TYPES = {
+    extension: mime
+    for _, extension, mime in (WEBP, *ORIGINAL_FORMATS.values())
+}
+WORKERS = getattr(settings, 'POSTS_THUMBNAIL_WORKERS', 2)
+
+ImageSource = namedtuple('ImageSource', 'type srcset src')
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=WORKERS, thread_name_prefix='thumbnails'
+        )
+    return _executor
+
+
+def image_storage():
+    return Post._meta.get_field('image').storage
+
+
+def source(name):
+    """Картинка поста для sorl — с хранилищем поля, как в шаблонах."""
+    return ImageFile(name, image_storage())
+
+
+def generate(name):
+    """Режет миниатюры и варианты картинки; возвращает число файлов."""
+    for geometry, options in THUMBNAILS:
+        get_thumbnail(source(name), geometry, **options)
+    manifest = make_variants(name)
+    encoded = json.dumps(manifest, separators=(',', ':'))
+    # варианты — часть поста: у постов меняются номера изменений
+    changes.update(Post.objects.filter(image=name), image_variants=encoded)
+    return len(THUMBNAILS) + len(manifest['w']) * len(manifest['f'])
+
+
+def generate_in_background(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось нарезать миниатюры %s', name)
+    finally:
+        close_old_connections()
+
+
+def pregenerate(post):
+    """Заказывает миниатюры картинки поста после фиксации транзакции.
+
+    Картинки хранятся по содержимому, так что повторная загрузка уже
+    известной картинки получает готовые варианты другого поста.
+    """
+    if not post.image:
+        return
+    name = post.image.name
+    manifest = Post.objects.filter(image=name).exclude(
+        image_variants=''
+    ).values_list('image_variants', flat=True).first()
+    if manifest:
+        changes.update(
+            Post.objects.filter(pk=post.pk), image_variants=manifest
+        )
+        post.image_variants = manifest
+        return
+    if not getattr(settings, 'POSTS_THUMBNAILS_ASYNC', True):
+        transaction.on_commit(lambda: generate(name))
+        return
+    transaction.on_commit(
+        lambda: executor().submit(generate_in_background, name)
+    )
+
+
+def variant_name(name, width, extension):
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    return f'{VARIANTS_DIR}/{stem}-{width}.{extension}'
+
+
+def make_variants(name):
+    """Нарезает варианты картинки ``name`` и возвращает их манифест.
+
+    Манифест — ``{"w": [ширины], "f": [расширения]}``: вариант есть
+    для каждой пары, а его имя выводится из имени картинки.
+    """
+    with image_storage().open(name) as file:
+        image = Image.open(file)
+        original = ORIGINAL_FORMATS.get(
+            image.format, ORIGINAL_FORMATS['JPEG']
+        )
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if original[0] == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    # кадр карточки, как у миниатюры с crop="center"
+    crop_width = min(image.width, round(image.height / VARIANT_RATIO))
+    frame = ImageOps.fit(
+        image, (crop_width, round(crop_width * VARIANT_RATIO)),
+        Image.LANCZOS
+    )
+    widths = [width for width in VARIANT_WIDTHS if width <= crop_width]
+    widths = widths or [crop_width]
+    formats = [original]
+    if features.check('webp'):
+        formats.insert(0, WEBP)
+    for width in widths:
+        variant = frame.resize(
+            (width, round(width * VARIANT_RATIO)), Image.LANCZOS
+        )
+        for image_format, extension, _ in formats:
+            buffer = BytesIO()
+            variant.save(buffer, image_format, quality=VARIANT_QUALITY)
+            target = variant_name(name, width, extension)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    return {'w': widths, 'f': [extension for _, extension, _ in formats]}
+
+
+def variant_url(name, width, extension):
+    return default_storage.url(variant_name(name, width, extension))
+
+
+def parse_manifest(manifest):
+    """Ширины и расширения вариантов из манифеста; ([], []) для пустого."""
+    try:
+        manifest = json.loads(manifest)
+        return manifest['w'], manifest['f']
+    except (ValueError, TypeError, KeyError):
+        # испорченный манифест: картинку покажет миниатюра sorl
+        return [], []
+
+
+def image_sources(post):
+    """Источники ``<picture>`` для картинки поста, WebP первым.
+
+    Последний источник — в формате оригинала, он же идёт в ``<img>``.
+    """
+    if not post.image or not post.image_variants:
+        return []
+    widths, extensions = parse_manifest(post.image_variants)
+    name = post.image.name
+    return [
+        ImageSource(
+            MIME_TYPES[extension],
+            ', '.join(
+                f'{variant_url(name, width, extension)} {width}w'
+                for width in widths
+            ),
+            variant_url(name, widths[-1], extension),
+        )
+        for extension in extensions
+    ]
+
+
+def release(name, manifest=''):
+    """Удаляет картинку с производными, если на неё не ссылаются посты.
+
+    Одна картинка может принадлежать нескольким постам, поэтому
+    проверка ссылок идёт после фиксации транзакции — и вместе с удалением
+    держит блокировку записи (``BEGIN IMMEDIATE``). Пост с той же
+    картинкой сохраняет файл в своей транзакции записи, так что он
+    либо виден проверке, либо заново пишет уже удалённый файл.
+    """
+    def delete():
+        using = router.db_for_write(Post)
+        with transaction.atomic(using=using):
+            if Post.objects.using(using).filter(image=name).exists():
+                return
+            try:
+                sorl_delete(source(name), delete_file=False)
+                widths, extensions = parse_manifest(manifest)
+                for width in widths:
+                    for extension in extensions:
+                        default_storage.delete(
+                            variant_name(name, width, extension)
+                        )
+                image_storage().delete(name)
+            except Exception:
+                # уборка не должна ломать удаление или правку поста
+                logger.exception('Не удалось удалить картинку %s', name)
+    transaction.on_commit(delete)
+
+
+def thumbnail_name(name, geometry, options):
+    """Имя файла миниатюры — то же, что вычислит ``get_thumbnail``."""
+    backend = default.backend
+    image = source(name)
+    options = dict(options)
+    # повторяет подготовку опций из ThumbnailBackend.get_thumbnail
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(image))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return backend._get_thumbnail_filename(image, geometry, options)
+
+
+def lookup(names, geometry, options):
+    """Уже нарезанные миниатюры картинок ``names``: {картинка: ImageFile}.
+
+    Ненарезанных в ответе нет — их сделает тег ``{% thumbnail %}``.
+    """
+    keys = {
+        add_prefix(ImageFile(
+            thumbnail_name(name, geometry, options), default.storage
+        ).key): name
+        for name in names
+    }
+    kvstore = default.kvstore
+    if not isinstance(kvstore, KVStore):
+        found = {key: kvstore._get_raw(key) for key in keys}
+    else:
+        found = kvstore.cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value'))
+            # пустые значения, как и sorl, кешируем, чтобы не спрашивать снова
+            kvstore.cache.set_many(
+                {key: stored.get(key, EMPTY_VALUE) for key in missing},
+                sorl_settings.THUMBNAIL_CACHE_TIMEOUT
+            )
+            found.update(stored)
+    return {
+        keys[key]: deserialize_image_file(value)
+        for key, value in found.items()
+        if value and value != EMPTY_VALUE
+    }
+
+
+def attach(posts):
+    """Проставляет постам ``thumbnail`` — миниатюру для карточки.
+
+    Постам с нарезанными вариантами картинки миниатюра не нужна.
+    """
+    posts = [post for post in posts if post.image and not post.image_variants]
+    try:
+        found = lookup({post.image.name for post in posts}, *CARD_THUMBNAIL)
+    except (AttributeError, TypeError):
+        logger.warning('Внутренности sorl изменились: миниатюры не '
+                       'ищутся заранее', exc_info=True)
+        found = {}
+    for post in posts:
+        post.thumbnail = found.get(post.image.name)
@@ -0,0 +1,160 @@
+"""Лента подписок с раздачей постов при записи (fan-out-on-write).
+
+Новый пост сразу раскладывается во «входящие» подписчиков автора
+(``TimelineEntry``), каждые входящие ограничены ``TIMELINE_SIZE`` постами.
+Посты «знаменитостей» — авторов, у которых не меньше
+``FANOUT_FOLLOWERS_LIMIT`` подписчиков, — не раздаются: они добавляются
+к входящим при чтении. Если после отписки автор опускается ниже порога,
+его последние посты раскладываются во входящие оставшихся подписчиков.
+Включается настройкой ``POSTS_FANOUT``.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from . import counters
+from .models import AuthorStats, Follow, Post, TimelineEntry, User
+
+
+TIMELINE_SIZE = getattr(settings, 'POSTS_TIMELINE_SIZE', 500)
+FANOUT_FOLLOWERS_LIMIT = getattr(
+    settings, 'POSTS_FANOUT_FOLLOWERS_LIMIT', 1000
+)
+BATCH_SIZE = 500
+
+
+def enabled():
+    return getattr(settings, 'POSTS_FANOUT', False)
+
+
+def is_celebrity(author_id):
+    return AuthorStats.objects.filter(
+        author_id=author_id, followers_count__gte=FANOUT_FOLLOWERS_LIMIT
+    ).exists()
+
+
+def fan_out(post):
+    """Раскладывает новый пост во входящие подписчиков автора."""
+    if not enabled() or is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id)
+    entries = (
+        TimelineEntry(user_id=user_id, post=post, created=post.created)
+        for user_id in followers.values_list('user_id', flat=True).iterator()
+    )
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+    trim(followers.values('user_id'))
+
+
+def fan_out_many(posts):
+    """``fan_out`` для пачки новых постов, например из импорта."""
+    if not enabled() or not posts:
+        return
+    authors = {post.author_id for post in posts}
+    authors -= set(AuthorStats.objects.filter(
+        author_id__in=authors, followers_count__gte=FANOUT_FOLLOWERS_LIMIT
+    ).values_list('author_id', flat=True))
+    followers = Follow.objects.filter(author_id__in=authors)
+    readers = {}
+    for author_id, user_id in followers.values_list('author_id', 'user_id'):
+        readers.setdefault(author_id, []).append(user_id)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, created=post.created)
+         for post in posts for user_id in readers.get(post.author_id, ())),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    trim(followers.values('user_id'))
+
+
+def backfill(user, author):
+    """Добавляет во входящие нового подписчика последние посты автора."""
+    if not enabled() or is_celebrity(author.pk):
+        return
+    posts = author.posts.order_by('-created')[:TIMELINE_SIZE]
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user=user, post_id=pk, created=created)
+         for pk, created in posts.values_list('pk', 'created')),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    trim(User.objects.filter(pk=user.pk).values('pk'))
+
+
+def prune(user, author):
+    """Убирает из входящих посты автора, от которого отписались."""
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+    if enabled() and AuthorStats.objects.filter(
+            author_id=author.pk,
+            followers_count=FANOUT_FOLLOWERS_LIMIT - 1).exists():
+        backfill_followers(author)
+
+
+def backfill_followers(author):
+    """Раскладывает посты бывшей «знаменитости» всем её подписчикам."""
+    posts = list(author.posts.order_by('-created').values_list(
+        'pk', 'created'
+    )[:TIMELINE_SIZE])
+    followers = Follow.objects.filter(author_id=author.pk)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk, created=created)
+         for user_id in followers.values_list('user_id', flat=True).iterator()
+         for pk, created in posts),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    trim(followers.values('user_id'))
+
+
+def trim(users):
+    """Оставляет во входящих ``users`` только ``TIMELINE_SIZE`` новых постов.
+
+    Одним запросом на всех пользователей и без ранжирования всех входящих:
+    для каждого по индексу (user, -created) берётся дата
+    ``TIMELINE_SIZE``-го поста, и удаляется только то, что старше неё.
+    У входящих, не дошедших до предела, такой даты нет.
+    """
+    users_sql, users_params = users.query.sql_with_params()
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH inboxes(user_id) AS ({users_sql}), cutoffs AS ('
+            f' SELECT user_id, ('
+            f'  SELECT created FROM {table} newest'
+            f'  WHERE newest.user_id = inboxes.user_id'
+            f'  ORDER BY created DESC LIMIT 1 OFFSET %s'
+            f' ) AS created FROM inboxes'
+            f') '
+            f'DELETE FROM {table} WHERE id IN ('
+            f' SELECT entry.id FROM cutoffs JOIN {table} entry'
+            f' ON entry.user_id = cutoffs.user_id'
+            f' AND entry.created < cutoffs.created)',
+            [*users_params, TIMELINE_SIZE - 1]
+        )
+
+
+def feeds(user, authors):
+    """Ключи ``counters`` ленты подписок: входящие и «знаменитости».
+
+    Входящие ограничены ``TIMELINE_SIZE``, поэтому считаются сами,
+    а не суммой лент авторов.
+    """
+    celebrities = AuthorStats.objects.filter(
+        author_id__in=authors, followers_count__gte=FANOUT_FOLLOWERS_LIMIT
+    ).values_list('author_id', flat=True)
+    return [counters.timeline_feed(user.pk),
+            *(counters.author_feed(pk) for pk in celebrities)]
+
+
+def feed(user):
+    """Посты ленты подписок: входящие плюс посты «знаменитостей»."""
+    celebrities = AuthorStats.objects.filter(
+        author__following__user=user,
+        followers_count__gte=FANOUT_FOLLOWERS_LIMIT
+    ).values('author_id')
+    inbox = TimelineEntry.objects.filter(user=user).values('post_id')
+    return Post.objects.filter(
+        Q(pk__in=inbox) | Q(author_id__in=celebrities)
+    )
@@ -1,16 +1,34 @@
+from django.conf import settings
+from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
 
+from core.db.routers import reads_from_replica
+from core.querybudget import query_budget
+
 from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
+from .paginators import CursorPaginator, FeedPaginator
+from . import (
+    caching, changes, counters, search as post_search, thumbnails, timeline
+)
+
+
+COMMENTS_PER_PAGE = getattr(settings, 'POSTS_COMMENTS_PER_PAGE', 20)
 
 
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
 def index(request):
     """Главная страница"""
     template = 'posts/index.html'
     post_list = Post.objects.select_related('author', 'group')
-    page = get_paginator_page(request, post_list, 10)
+    page = get_paginator_page(
+        request, post_list, 10, feeds=[counters.INDEX_FEED], cursor=True
+    )
+    caching.depends_on(request, caching.INDEX_SCOPE, *caching.scopes_of(page))
     context = {
         'page_obj': page,
         'index': True
@@ -18,12 +36,22 @@ def index(request):
     return render(request, template, context)
 
 
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
 def group_posts(request, slug):
     """Последние 10 постов в группе"""
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
     post_list = group.post_set.all().select_related('author')
-    page = get_paginator_page(request, post_list, 10)
+    page = get_paginator_page(
+        request, post_list, 10,
+        feeds=[counters.group_feed(group.pk)], cursor=True
+    )
+    caching.depends_on(
+        request, caching.group_scope(group.pk), *caching.scopes_of(page)
+    )
     context = {
         'group': group,
         'page_obj': page,
@@ -32,19 +60,39 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
-def get_paginator_page(request, post_list, num):
-    """Возвращает страницу пагинатора"""
-    paginator = Paginator(post_list, num)
+def get_paginator_page(request, post_list, num, feeds=None, cursor=False):
+    """Возвращает страницу пагинатора.
+
+    С ``cursor=True`` страницы после первой выбираются по курсору
+    ``?cursor=`` (keyset), а не через OFFSET. ``feeds`` — ключи лент из
+    ``counters``, по которым берётся кешированное число постов.
+    """
     page_number = request.GET.get('page')
+    if cursor:
+        paginator = CursorPaginator(post_list, num, feeds=feeds)
+        return paginator.get_page(page_number, request.GET.get('cursor'))
+    paginator = FeedPaginator(post_list, num, feeds=feeds)
     page = paginator.get_page(page_number)
     return page
 
 
+@query_budget(8)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
 def profile(request, username):
     """Страница пользователя"""
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
     post_list = author.posts.all().select_related('group')
-    page = get_paginator_page(request, post_list, 10)
+    page = get_paginator_page(
+        request, post_list, 10,
+        feeds=[counters.author_feed(author.pk)], cursor=True
+    )
+    caching.depends_on(
+        request, caching.author_scope(author.pk), *caching.scopes_of(page)
+    )
     context = {
         'author': author,
         'page_obj': page
@@ -55,11 +103,50 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(6)
+def changes_feed(request):
+    """Изменения групп, постов и комментариев после номера ``since``"""
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = int(request.GET.get('limit', changes.CHANGES_LIMIT))
+    except ValueError:
+        return JsonResponse(
+            {'error': 'since и limit должны быть целыми'}, status=400
+        )
+    entries = changes.since(since, max(1, min(limit, changes.CHANGES_LIMIT)))
+    return JsonResponse({
+        'changes': [entry._asdict() for entry in entries],
+        'next': entries[-1].seq if entries else since,
+    })
+
+
+@query_budget(6)
+def search(request):
+    """Поиск по тексту постов, самые релевантные — первыми"""
+    query = request.GET.get('q', '').strip()
+    results = post_search.SearchResults(query)
+    page = get_paginator_page(request, results, 10)
+    context = {
+        'page_obj': page,
+        'q': query,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
 def post_detail(request, post_id):
     """Детальный просмотр публикции"""
-    post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.all().select_related('author')
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id
+    )
+    comments = get_comments_page(request, post)
     form = CommentForm()
+    caching.depends_on(
+        request, caching.post_scope(post.pk), *caching.scopes_of([post])
+    )
     context = {
         'post': post,
         'comments': comments,
@@ -68,6 +155,45 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def get_comments_page(request, post):
+    """Страница комментариев поста, от новых к старым, по курсору."""
+    return get_paginator_page(
+        request, post.comments.select_related('author'), COMMENTS_PER_PAGE,
+        feeds=[counters.comments_feed(post.pk)], cursor=True
+    )
+
+
+@query_budget(6)
+@reads_from_replica
+@caching.conditional_page
+@caching.cache_anonymous_page
+def post_comments(request, post_id):
+    """Следующая порция комментариев: фрагмент HTML или JSON"""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = get_comments_page(request, post)
+    caching.depends_on(request, caching.post_scope(post.pk))
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'count': comments.paginator.count,
+            'next': comments.next_cursor,
+            'comments': [
+                {
+                    'id': comment.pk,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'created': comment.created.isoformat(),
+                }
+                for comment in comments
+            ],
+        })
+    context = {
+        'post': post,
+        'comments': comments,
+    }
+    return render(request, 'includes/comment_list.html', context)
+
+
+@query_budget(20)
 @login_required
 def post_create(request):
     """Создание новой публикации"""
@@ -76,10 +202,13 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.pregenerate(post)
+        timeline.fan_out(post)
         return redirect(f'/profile/{request.user}/')
     return render(request, 'posts/create_post.html', {'form': form})
 
 
+@query_budget(20)
 @login_required
 def post_edit(request, post_id):
     """Редактирование публикации"""
@@ -97,10 +226,13 @@ def post_edit(request, post_id):
     }
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.pregenerate(post)
         return redirect(f'/posts/{post_id}/')
     return render(request, 'posts/create_post.html', context)
 
 
+@query_budget(10)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -113,13 +245,24 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(7)
+@reads_from_replica
 @login_required
 def follow_index(request):
     template = 'posts/follow.html'
-    follower = request.user.follower.values_list('author_id', flat=True)
-    post_list = Post.objects.filter(author__in=follower).\
-        select_related('author', 'group')
-    page = get_paginator_page(request, post_list, 10)
+    follower = list(
+        request.user.follower.values_list('author_id', flat=True)
+    )
+    if timeline.enabled():
+        post_list = timeline.feed(request.user)
+        feeds = timeline.feeds(request.user, follower)
+    else:
+        post_list = Post.objects.filter(author__in=follower)
+        feeds = [counters.author_feed(pk) for pk in follower]
+    post_list = post_list.select_related('author', 'group')
+    page = get_paginator_page(
+        request, post_list, 10, feeds=feeds, cursor=True
+    )
     context = {
         'page_obj': page,
         'follow': True
@@ -127,19 +270,24 @@ def follow_index(request):
     return render(request, template, context)
 
 
+@query_budget(15)
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.get_or_create(
+        _, created = Follow.objects.get_or_create(
             user=request.user,
             author=author
         )
+        if created:
+            timeline.backfill(request.user, author)
     return redirect('posts:profile', username=username)
 
 
+@query_budget(15)
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.get(user=request.user, author=author).delete()
+    timeline.prune(request.user, author)
     return redirect('posts:profile', username=username)
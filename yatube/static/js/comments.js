@@ -0,0 +1,24 @@
+// «Показать ещё» под комментариями: вместо перехода на следующую
+// страницу подгружаем фрагмент и вставляем его на место ссылки.
+// Если фрагмент не пришёл, переходим по ссылке как обычно.
+document.addEventListener('click', function (event) {
+  const link = event.target.closest('[data-more]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  fetch(link.dataset.more)
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.status);
+      }
+      return response.text();
+    })
+    .then(function (html) {
+      link.insertAdjacentHTML('beforebegin', html);
+      link.remove();
+    })
+    .catch(function () {
+      location.href = link.href;
+    });
+});
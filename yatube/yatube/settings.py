@@ -39,14 +39,11 @@ ALLOWED_HOSTS = [
     'testserver',
 ]
 
-if DEBUG:  # If using Docker
-    import socket  # only if you haven't already imported this
-    hostname, _, ips = socket.gethostbyname_ex(socket.gethostname())
-    INTERNAL_IPS = [ip[: ip.rfind(".")] + ".1" for ip in ips] + ["127.0.0.1", "10.0.2.2"]
-
-# INTERNAL_IPS = [
-#     '127.0.0.1',
-# ]
+# Адреса, которым видна панель debug_toolbar. Из Docker запросы приходят
+# со шлюза сети контейнера — его адрес передаётся в DJANGO_INTERNAL_IPS.
+INTERNAL_IPS = ['127.0.0.1', '10.0.2.2'] + [
+    ip for ip in os.environ.get('DJANGO_INTERNAL_IPS', '').split(',') if ip
+]
 
 # Application definition
 
@@ -67,10 +64,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.querybudget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db.routers.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -78,11 +78,24 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'yatube.urls'
 
+# Превышение бюджета запросов (core.querybudget) в тестах роняет тест,
+# в работе только пишется в лог.
+TEST_RUNNER = 'core.test_runner.QueryBudgetTestRunner'
+
+# Метрики запросов (core.metrics): доля запросов, у которых замеряется
+# время базы и шаблонов, и токен страницы /metrics. Без токена страницы нет:
+# за прокси на той же машине любой запрос приходит с 127.0.0.1.
+METRICS_SAMPLE_RATE = float(
+    os.environ.get('DJANGO_METRICS_SAMPLE_RATE', 0.05)
+)
+METRICS_TOKEN = os.environ.get('DJANGO_METRICS_TOKEN', '')
+
 # Путь к директории с шаблонами вынесен в переменную:
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, который замеряет время отрисовки (core.metrics)
+        'BACKEND': 'core.metrics.InstrumentedTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -103,13 +116,34 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# core.db.backends.sqlite3 — SQLite с WAL, прагмами и повтором запросов
+# при блокировке; соединения живут CONN_MAX_AGE секунд.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 60)),
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
+# Реплики для чтения лент (core.db.routers). На своей машине репликой
+# служит второй файл SQLite (DJANGO_REPLICA_DB), который обновляет
+# команда sync_replica; тесты запускаются без реплики.
+DATABASE_REPLICAS = []
+if os.environ.get('DJANGO_REPLICA_DB'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ['DJANGO_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append('replica')
+DATABASE_ROUTERS = ['core.db.routers.ReplicaRouter']
+# сколько секунд после записи клиент читает только с основной базы
+REPLICA_STICKY_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -149,9 +183,24 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Боевая раздача файлов: статика собирается collectstatic с хешами
+# в именах и сжатыми копиями, а статику и медиа отдаёт core.fileserver
+# прямо из WSGI (см. yatube/wsgi.py).
+SERVE_FILES = bool(os.environ.get('DJANGO_SERVE_FILES', False))
+if SERVE_FILES:
+    STATICFILES_STORAGE = (
+        'core.staticfiles.CompressedManifestStaticFilesStorage'
+    )
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# загрузки пишутся сразу на диск: картинки постов обрабатываются
+# потоково (posts.images) и не должны оседать в памяти целиком
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -160,10 +209,48 @@ LOGIN_REDIRECT_URL = 'posts:index'
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+# Кеш должен быть общим для всех воркеров, иначе у каждого процесса своя
+# холодная копия, а сброс кеша сигналами не доходит до соседей.
+# DJANGO_CACHE_BACKEND: sqlite (по умолчанию), file или locmem.
+CACHE_BACKENDS = {
+    'sqlite': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+# ``default`` считает попадания и промахи для метрик (core.cache) и
+# передаёт обращения настоящему кешу ``store``.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.CountingCache',
+        'LOCATION': 'store',
+    },
+    'store': {
+        **CACHE_BACKENDS[os.environ.get('DJANGO_CACHE_BACKEND', 'sqlite')],
+        # пространство имён и версия: смена версии сбрасывает весь кеш
+        'KEY_PREFIX': os.environ.get('DJANGO_CACHE_PREFIX', 'yatube'),
+        'VERSION': int(os.environ.get('DJANGO_CACHE_VERSION', 1)),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+# Тесты не трогают кеш разработки: QueryBudgetTestRunner и фикстура
+# в tests/conftest.py подменяют им CACHES на кеш в памяти.
+TEST_CACHES = {
+    'default': CACHES['default'],
+    'store': {
+        **CACHE_BACKENDS['locmem'],
+        'LOCATION': 'yatube-tests',
+        'KEY_PREFIX': 'yatube',
+    },
 }
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
@@ -19,9 +19,12 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.views import metrics
+
 
 urlpatterns = [
     path('', include('posts.urls')),
+    path('api/v1/', include('posts.api_urls')),
     path('groups/', include('posts.urls')),
     path('profile/', include('posts.urls')),
     path('admin/', admin.site.urls),
@@ -29,6 +32,7 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls')),
     path('create/', include('posts.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 if settings.DEBUG:
     import debug_toolbar